@@ -0,0 +1,82 @@
+"""
+Times the construction of the LALR tables of synthetic grammars of
+increasing size:
+
+    python -m benchmarks.lalr_construction [max_size]
+
+A grammar of size n has n levels of binary operators resolved by
+precedence, n kinds of statements with optional argument lists and n
+functions, so about 5 * n productions. The time grows about five times each
+time the size doubles, mostly in the unions of the lookahead sets, whose work
+grows with the number of states times the number of terminals.
+"""
+import sys
+import time
+import warnings
+
+from rply import ParserGenerator
+
+
+def null_callback(*args):
+    return None
+
+
+def synthetic_grammar(n):
+    """
+    Returns a :class:`~rply.ParserGenerator` for a grammar of size `n`.
+    """
+    operators = ["OP%d" % i for i in range(n)]
+    keywords = ["KW%d" % i for i in range(n)]
+    functions = ["FN%d" % i for i in range(n)]
+    pg = ParserGenerator(
+        operators + keywords + functions + [
+            "IDENTIFIER", "NUMBER", "(", ")", "{", "}", ",", ";", "=",
+        ],
+        precedence=[("left", [op]) for op in operators]
+    )
+    rules = [
+        "program : statements",
+        "statements : statements statement",
+        "statements : statement",
+        "statement : { statements }",
+        "expression : ( expression )",
+        "expression : IDENTIFIER",
+        "expression : NUMBER",
+        "arguments : arguments , expression",
+        "arguments : expression",
+        "optional_arguments : arguments",
+        "optional_arguments : ",
+    ]
+    for op in operators:
+        rules.append("expression : expression %s expression" % op)
+    for keyword in keywords:
+        rules.append("statement : %s ( optional_arguments ) ;" % keyword)
+        rules.append("statement : %s IDENTIFIER = expression ;" % keyword)
+    for i, function in enumerate(functions):
+        rules.append("expression : call%d" % i)
+        rules.append("call%d : %s ( optional_arguments )" % (i, function))
+    for rule in rules:
+        pg.production(rule)(null_callback)
+    return pg
+
+
+def main(max_size=160, repeat=3):
+    warnings.simplefilter("ignore")
+    print("%6s %12s %8s %12s" % ("size", "productions", "states", "seconds"))
+    size = 10
+    while size <= max_size:
+        pg = synthetic_grammar(size)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            table = pg.build().lr_table
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        print("%6d %12d %8d %12.3f" % (
+            size, len(table.grammar.productions), len(table.lr_action), best
+        ))
+        size *= 2
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,74 @@
+"""
+Compares the parser backends of rply on the compiler's grammar:
+
+    python -m benchmarks.parser_backends [copies]
+
+"table" is the LRParser, "dense" the DenseLRParser with integer-indexed
+tables and "direct" the DirectLRParser running generated code. Each backend
+parses the same tokens with the compiler's callbacks, and with callbacks
+that do nothing to measure the parser alone. Each backend is warmed up first,
+then the timed runs alternate between the backends, so the order they run in
+doesn't favour any of them.
+"""
+import sys
+import timeit
+import warnings
+
+from compiler.lexer import Lexer
+from compiler.parser import Parser, ParserState
+from rply.codegen import DirectLRParser
+from rply.parser import DenseLRParser, LRParser
+
+
+SOURCE = """
+function userDefined() {
+    let pi = __PI__;
+    let e = __E__;
+    print(2 * (pi + e - 1) / 3);
+    print(abs(e - pi));
+    print(pow(pi, e));
+}
+let a = 5 - 2;
+let b = 5;
+if (a > b) {
+    print(sin(a));
+} else {
+    print(a); print(b); print(b - a);
+}
+"""
+
+
+def null_callback(*args):
+    return None
+
+
+def main(copies=50, repeat=15, warmup=3):
+    warnings.simplefilter("ignore")
+    tokens = list(Lexer().build().lex(SOURCE * copies))
+    table = Parser().pg.build().lr_table
+    callbacks = [p.func for p in table.grammar.productions]
+    backends = [
+        ("table", LRParser), ("dense", DenseLRParser),
+        ("direct", DirectLRParser),
+    ]
+    print("%d tokens, best of %d interleaved runs" % (len(tokens), repeat))
+    for label, funcs in [("compiler", callbacks), ("null", None)]:
+        for p, func in zip(table.grammar.productions, callbacks):
+            p.func = func if funcs is not None else null_callback
+        parsers = [(name, cls(table, None)) for name, cls in backends]
+        for name, parser in parsers:
+            for _ in range(warmup):
+                parser.parse(tokens, state=ParserState())
+        best = dict.fromkeys([name for name, _ in parsers], float("inf"))
+        for i in range(repeat):
+            # Rotate the order each round, so no backend always runs first !
+            for name, parser in parsers[i % len(parsers):] + parsers[:i % len(parsers)]:
+                start = timeit.default_timer()
+                parser.parse(tokens, state=ParserState())
+                best[name] = min(best[name], timeit.default_timer() - start)
+        for name, _ in parsers:
+            print("%-8s callbacks %-7s %8.2f ms" % (label, name, best[name] * 1000))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -1,3 +1,5 @@
+import operator
+
 from rply.token import BaseBox
 from compiler.JSONparsedTree import Node
 from compiler.errors import *
@@ -6,25 +8,26 @@ from compiler.errors import *
 # All token types inherit rply's basebox as rpython needs this
 # These classes represent our Abstract Syntax Tree
 # TODO: deprecate eval(env) as we move to compiling and then interpreting
+# eval(node) records the semantic tree under node, eval() only runs the program without allocating any Node !
 
 class Program(BaseBox):
-    def __init__(self, statement, program, state):
+    def __init__(self, statement, state):
         self.state = state
-        if type(program) is Program:
-            self.statements = program.get_statements()
-            self.statements.insert(0, statement)
-        else:
-            self.statements = [statement]
+        self.statements = [statement]
 
     def add_statement(self, statement):
-        self.statements.insert(0, statement)
+        self.statements.append(statement)
 
     def get_statements(self):
         return self.statements
 
-    def eval(self, node):
+    def eval(self, node=None):
         # print("Program<%s> statement's counter: %s" % (self, len(self.statements)))
         result = None
+        if node is None:
+            for statement in self.statements:
+                result = statement.eval()
+            return result
         for i, statement in enumerate(self.statements):
             left = Node('statement_full')
             right = Node('program')
@@ -44,24 +47,40 @@ class Program(BaseBox):
         return result
 
 
+class StreamedProgram(BaseBox):
+    # Executes each top-level statement as soon as it is parsed, without holding on to the statements !
+    def __init__(self, state):
+        self.state = state
+        self.count = 0
+        self.result = None
+
+    def run(self, statement):
+        self.result = statement.eval()  # Nobody looks at the semantic tree of a streamed statement !
+        self.count += 1
+        return self
+
+    def eval(self, node=None):
+        return self.result  # The statements already ran while parsing !
+
+
 class Block(BaseBox):
-    def __init__(self, statement, block, state):
+    def __init__(self, statement, state):
         self.state = state
-        if type(block) is Block:
-            self.statements = block.get_statements()
-            self.statements.insert(0, statement)
-        else:
-            self.statements = [statement]
+        self.statements = [statement]
 
     def add_statement(self, statement):
-        self.statements.insert(0, statement)
+        self.statements.append(statement)
 
     def get_statements(self):
         return self.statements
 
-    def eval(self, node):
+    def eval(self, node=None):
         # print("Block<%s> statement's counter: %s" % (self, len(self.statements)))
         result = None
+        if node is None:
+            for statement in self.statements:
+                result = statement.eval()
+            return result
         for i, statement in enumerate(self.statements):
             left = Node('statement_full')
             right = Node('block')
@@ -88,15 +107,18 @@ class If(BaseBox):
         self.else_body = else_body
         self.state = state
 
-    def eval(self, node):
-        expression = Node("expression")
-        node.children.extend([Node("IF"), Node("("), expression, Node(")")])
+    def eval(self, node=None):
+        expression = block = else_block = None
+        if node is not None:
+            expression = Node("expression")
+            node.children.extend([Node("IF"), Node("("), expression, Node(")")])
         condition = self.condition.eval(expression)
-        block = Node("block")
-        node.children.extend([Node("{"), block, Node("}")])
-        else_block = Node("block")
-        if self.else_body is not None:
-            node.children.extend([Node("else"), Node("{"), else_block, Node("}")])
+        if node is not None:  # Only after the condition, which may raise !
+            block = Node("block")
+            node.children.extend([Node("{"), block, Node("}")])
+            else_block = Node("block")
+            if self.else_body is not None:
+                node.children.extend([Node("else"), Node("{"), else_block, Node("}")])
         if bool(condition) is True:
             return self.body.eval(block)
         else:
@@ -117,11 +139,17 @@ class Variable(BaseBox):
     def get_name(self):
         return str(self.name)
 
-    def eval(self, node):
+    def eval(self, node=None):
+        value = self.state.variables.get(self.name)
+        if node is None:
+            if value is not None:
+                self.value = value
+                return value
+            raise LogicError("Variable <%s> is not yet defined" % str(self.name))
         identifier = Node("IDENTIFIER")
         node.children.extend([identifier])
-        if dict(self.state.variables).get(self.name) is not None:
-            self.value = self.state.variables[self.name]
+        if value is not None:
+            self.value = value
             identifier.children.extend([Node(self.name, [Node(self.value)])])
             return self.value
         identifier.children.extend([Node("Variable <%s> is not yet defined" % str(self.name))])
@@ -141,9 +169,10 @@ class FunctionDeclaration(BaseBox):
         self.block = block
         state.functions[self.name] = self
 
-    def eval(self, node):
-        identifier = Node(self.name)
-        node.children.extend([Node("FUNCTION"), identifier, Node("{"), Node("block"), Node("}")])
+    def eval(self, node=None):
+        if node is not None:
+            identifier = Node(self.name)
+            node.children.extend([Node("FUNCTION"), identifier, Node("{"), Node("block"), Node("}")])
         return self
 
     def to_string(self):
@@ -156,9 +185,14 @@ class CallFunction(BaseBox):
         self.args = args
         self.state = state
 
-    def eval(self, node):
-        identifier = Node(self.name + " ( )")
-        node.children.extend([identifier])
+    def eval(self, node=None):
+        identifier = None
+        if node is not None:
+            identifier = Node(self.name + " ( )")
+            node.children.extend([identifier])
+        if self.name not in self.state.functions:
+            # A streamed program can only call functions declared before the call !
+            raise LogicError("Function <%s> is not yet defined" % str(self.name))
         return self.state.functions[self.name].block.eval(identifier)
 
     def to_string(self):
@@ -172,7 +206,7 @@ class BaseFunction(BaseBox):
         self.state = state
         self.roundOffDigits = 10
 
-    def eval(self, node):
+    def eval(self, node=None):
         raise NotImplementedError("This is abstract method from abstract class BaseFunction(BaseBox){...} !")
 
     def to_string(self):
@@ -186,10 +220,12 @@ class Absolute(BaseFunction):
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
-    def eval(self, node):
+    def eval(self, node=None):
         import re as regex
-        expression = Node("expression")
-        node.children.extend([Node("ABSOLUTE"), Node("("), expression, Node(")"), Node(";")])
+        expression = None
+        if node is not None:
+            expression = Node("expression")
+            node.children.extend([Node("ABSOLUTE"), Node("("), expression, Node(")"), Node(";")])
         self.value = self.expression.eval(expression)
         if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
             self.value = abs(self.value)
@@ -205,10 +241,12 @@ class Sin(BaseFunction):
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
-    def eval(self, node):
+    def eval(self, node=None):
         import re as regex
-        expression = Node("expression")
-        node.children.extend([Node("SIN"), Node("("), expression, Node(")")])
+        expression = None
+        if node is not None:
+            expression = Node("expression")
+            node.children.extend([Node("SIN"), Node("("), expression, Node(")")])
         self.value = self.expression.eval(expression)
         if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
             import math
@@ -225,10 +263,12 @@ class Cos(BaseFunction):
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
-    def eval(self, node):
+    def eval(self, node=None):
         import re as regex
-        expression = Node("expression")
-        node.children.extend([Node("COS"), Node("("), expression, Node(")")])
+        expression = None
+        if node is not None:
+            expression = Node("expression")
+            node.children.extend([Node("COS"), Node("("), expression, Node(")")])
         self.value = self.expression.eval(expression)
         if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
             import math
@@ -245,10 +285,12 @@ class Tan(BaseFunction):
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
-    def eval(self, node):
+    def eval(self, node=None):
         import re as regex
-        expression = Node("expression")
-        node.children.extend([Node("TAN"), Node("("), expression, Node(")")])
+        expression = None
+        if node is not None:
+            expression = Node("expression")
+            node.children.extend([Node("TAN"), Node("("), expression, Node(")")])
         self.value = self.expression.eval(expression)
         if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
             import math
@@ -267,10 +309,12 @@ class Pow(BaseFunction):
         self.expression2 = expression2
         self.value2 = None
 
-    def eval(self, node):
-        expression = Node("expression")
-        expression2 = Node("expression")
-        node.children.extend([Node("POWER"), Node("("), expression, Node(","), expression2, Node(")")])
+    def eval(self, node=None):
+        expression = expression2 = None
+        if node is not None:
+            expression = Node("expression")
+            expression2 = Node("expression")
+            node.children.extend([Node("POWER"), Node("("), expression, Node(","), expression2, Node(")")])
         self.value = self.expression.eval(expression)
         self.value2 = self.expression2.eval(expression2)
         import re as regex
@@ -293,11 +337,12 @@ class Constant(BaseBox):
         self.value = None
         self.state = state
 
-    def eval(self, node):
-        value = Node(self.value)
-        typed = Node(self.__class__.__name__.upper(), [value])
-        constant = Node("const", [typed])
-        node.children.extend([constant])
+    def eval(self, node=None):
+        if node is not None:
+            value = Node(self.value)
+            typed = Node(self.__class__.__name__.upper(), [value])
+            constant = Node("const", [typed])
+            node.children.extend([constant])
         return self.value
 
     def to_string(self):
@@ -381,20 +426,33 @@ class ConstantE(Constant):
 
 
 class BinaryOp(BaseBox):
+    symbol = None  # Shown between both operands in the semantic tree !
+    operation = None  # Applied to the values of both operands !
+
     def __init__(self, left, right, state):
         self.left = left
         self.right = right
         self.state = state
 
+    def eval(self, node=None):
+        if node is None:
+            return self.operation(self.left.eval(), self.right.eval())
+        left = Node("expression")
+        right = Node("expression")
+        node.children.extend([left, Node(self.symbol), right])
+        return self.operation(self.left.eval(left), self.right.eval(right))
+
 
 class Assignment(BinaryOp):
-    def eval(self, node):
+    def eval(self, node=None):
         if isinstance(self.left, Variable):
             var_name = self.left.get_name()
-            if dict(self.state.variables).get(var_name) is None:
-                identifier = Node("IDENTIFIER", [Node(var_name)])
-                expression = Node("expression")
-                node.children.extend([Node("LET"), identifier, Node("="), expression])
+            if self.state.variables.get(var_name) is None:
+                expression = None
+                if node is not None:
+                    identifier = Node("IDENTIFIER", [Node(var_name)])
+                    expression = Node("expression")
+                    node.children.extend([Node("LET"), identifier, Node("="), expression])
                 self.state.variables[var_name] = self.right.eval(expression)
                 # print(self.state.variables)
                 return self.state.variables  # Return the ParserState() that hold the variables.
@@ -410,98 +468,77 @@ class Assignment(BinaryOp):
 
 
 class Sum(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("+"), right])
-        return self.left.eval(left) + self.right.eval(right)
+    symbol = "+"
+    operation = operator.add
 
 
 class Sub(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("-"), right])
-        return self.left.eval(left) - self.right.eval(right)
+    symbol = "-"
+    operation = operator.sub
 
 
 class Mul(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("*"), right])
-        return self.left.eval(left) * self.right.eval(right)
+    symbol = "*"
+    operation = operator.mul
 
 
 class Div(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("/"), right])
-        return self.left.eval(left) / self.right.eval(right)
+    symbol = "/"
+    operation = operator.truediv
 
 
 class Equal(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("=="), right])
-        return self.left.eval(left) == self.right.eval(right)
+    symbol = "=="
+    operation = operator.eq
 
 
 class NotEqual(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("!="), right])
-        return self.left.eval(left) != self.right.eval(right)
+    symbol = "!="
+    operation = operator.ne
 
 
 class GreaterThan(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node(">"), right])
-        return self.left.eval(left) > self.right.eval(right)
+    symbol = ">"
+    operation = operator.gt
 
 
 class LessThan(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("<"), right])
-        return self.left.eval(left) < self.right.eval(right)
+    symbol = "<"
+    operation = operator.lt
 
 
 class GreaterThanEqual(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node(">="), right])
-        return self.left.eval(left) >= self.right.eval(right)
+    symbol = ">="
+    operation = operator.ge
 
 
 class LessThanEqual(BinaryOp):
-    def eval(self, node):
-        left = Node("expression")
-        right = Node("expression")
-        node.children.extend([left, Node("<="), right])
-        return self.left.eval(left) <= self.right.eval(right)
+    symbol = "<="
+    operation = operator.le
 
 
+# And & Or only evaluate their right operand when needed !
 class And(BinaryOp):
-    def eval(self, node):
+    symbol = "and"
+
+    def eval(self, node=None):
+        if node is None:
+            return self.left.eval() and self.right.eval()
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("and"), right])
+        node.children.extend([left, Node(self.symbol), right])
         return self.left.eval(left) and self.right.eval(right)
 
 
 class Or(BinaryOp):
-    def eval(self, node):
+    symbol = "or"
+
+    def eval(self, node=None):
+        if node is None:
+            return self.left.eval() or self.right.eval()
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("or"), right])
+        node.children.extend([left, Node(self.symbol), right])
         return self.left.eval(left) or self.right.eval(right)
 
 
@@ -510,12 +547,14 @@ class Not(BaseBox):
         self.value = expression
         self.state = state
 
-    def eval(self, node):
-        expression = Node("expression")
-        node.children.extend([Node("Not"), expression])
-        self.value = self.value.eval(expression)
-        if isinstance(self.value, bool):
-            return not bool(self.value)
+    def eval(self, node=None):
+        expression = None
+        if node is not None:
+            expression = Node("expression")
+            node.children.extend([Node("Not"), expression])
+        value = self.value.eval(expression)  # Keeps the operand, so a function using 'not' can run again !
+        if isinstance(value, bool):
+            return not value
         raise LogicError("Cannot 'not' that")
 
 
@@ -524,7 +563,13 @@ class Print(BaseBox):
         self.value = expression
         self.state = state
 
-    def eval(self, node):
+    def eval(self, node=None):
+        if node is None:
+            if self.value is None:
+                print()
+            else:
+                print(self.value.eval())
+            return
         node.children.extend([Node("PRINT"), Node("(")])
         if self.value is None:
             print()
@@ -540,15 +585,19 @@ class Input(BaseBox):
         self.value = expression
         self.state = state
 
-    def eval(self, node):
-        node.children.extend([Node("CONSOLE_INPUT"), Node("(")])
+    def eval(self, node=None):
+        if node is not None:
+            node.children.extend([Node("CONSOLE_INPUT"), Node("(")])
         if self.value is None:
             result = input()
         else:
-            expression = Node("expression")
-            node.children.extend([expression])
+            expression = None
+            if node is not None:
+                expression = Node("expression")
+                node.children.extend([expression])
             result = input(self.value.eval(expression))
-        node.children.extend([Node(")")])
+        if node is not None:
+            node.children.extend([Node(")")])
         import re as regex
         if regex.search('^-?\d+(\.\d+)?$', str(result)):
             return float(result)
@@ -560,7 +609,9 @@ class Main(BaseBox):
     def __init__(self, program):
         self.program = program
 
-    def eval(self, node):
+    def eval(self, node=None):
+        if node is None:
+            return self.program.eval()
         program = Node("program")
         node.children.extend([program])
         return self.program.eval(program)
@@ -570,7 +621,9 @@ class ExpressParenthesis(BaseBox):
     def __init__(self, expression):
         self.expression = expression
 
-    def eval(self, node):
+    def eval(self, node=None):
+        if node is None:
+            return self.expression.eval()
         expression = Node("expression")
         node.children.extend([Node("("), expression, Node(")")])
         return self.expression.eval(expression)
@@ -580,7 +633,9 @@ class StatementFull(BaseBox):
     def __init__(self, statement):
         self.statement = statement
 
-    def eval(self, node):
+    def eval(self, node=None):
+        if node is None:
+            return self.statement.eval()
         statement = Node("statement")
         node.children.extend([statement, Node(";")])
         return self.statement.eval(statement)
@@ -590,7 +645,9 @@ class Statement(BaseBox):
     def __init__(self, expression):
         self.expression = expression
 
-    def eval(self, node):
+    def eval(self, node=None):
+        if node is None:
+            return self.expression.eval()
         expression = Node("expression")
         node.children.extend([expression])
         return self.expression.eval(expression)
@@ -1,5 +1,7 @@
 import json
 
+from rply.token import SourcePosition, Token
+
 
 class Node:
     def __init__(self, arg_name, arg_children=None):
@@ -28,6 +30,10 @@ class Wrapper:
 
 def serialize(obj):
     """JSON serializer for objects not serializable by default json code"""
+    if isinstance(obj, SourcePosition):  # Positions may be resolved lazily !
+        return {"idx": obj.idx, "lineno": obj.lineno, "colno": obj.colno}
+    if isinstance(obj, Token):  # Token values may be decoded lazily !
+        return {"name": obj.name, "value": obj.value, "source_pos": obj.source_pos}
     try:
         return obj.__dict__
     except AttributeError:
@@ -0,0 +1,448 @@
+import marshal
+import math
+import operator
+import re
+from array import array
+
+from compiler.AbstractSyntaxTree import *
+from compiler.errors import *
+from compiler.lexer import Lexer
+from compiler.parser import Parser, ParserState
+
+VERSION = 1
+
+# The values accepted by the math functions, as matched by their eval() !
+NUMERIC = re.compile(r'^-?\d+(\.\d+)?$')
+
+# Opcodes, the ones up to POP take no operand !
+HALT = 0  # Return the value on top of the stack from the program !
+POP = 1
+ADD = 2
+SUB = 3
+MUL = 4
+DIV = 5
+NOT = 6
+RETURN = 7  # Return from a function, leaving its value on the stack !
+PRINT = 8
+PRINT_EMPTY = 9
+INPUT = 10
+INPUT_PROMPT = 11
+ABS = 12
+POW = 13
+CONST = 14  # Push constants[operand] !
+LOAD = 15  # Push the variable names[operand] !
+CHECK_LET = 16  # Raise ImmutableError if the variable names[operand] is defined !
+LET = 17  # Define the variable names[operand] to the popped value, then push the variables !
+COMPARE = 18  # Apply COMPARISONS[operand] to the two popped values !
+JUMP = 19
+POP_JUMP_IF_FALSE = 20
+JUMP_IF_FALSE_OR_POP = 21
+JUMP_IF_TRUE_OR_POP = 22
+CALL = 23  # Call the function bound to names[operand] !
+DECLARE = 24  # Push the Function functions[operand] !
+SIN = 25  # Operand: the number of digits to round to !
+COS = 26
+TAN = 27
+
+OPNAMES = [
+    'HALT', 'POP', 'ADD', 'SUB', 'MUL', 'DIV', 'NOT', 'RETURN', 'PRINT', 'PRINT_EMPTY', 'INPUT', 'INPUT_PROMPT', 'ABS',
+    'POW', 'CONST', 'LOAD', 'CHECK_LET', 'LET', 'COMPARE', 'JUMP', 'POP_JUMP_IF_FALSE', 'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP', 'CALL', 'DECLARE', 'SIN', 'COS', 'TAN',
+]
+HAS_OPERAND = CONST
+
+COMPARISONS = [operator.eq, operator.ne, operator.gt, operator.lt, operator.ge, operator.le]
+ARITHMETIC = {operator.add: ADD, operator.sub: SUB, operator.mul: MUL, operator.truediv: DIV}
+
+# Calls nested deeper than this raise a RecursionError, like eval() would !
+MAX_CALL_DEPTH = 10000
+
+
+class Function:
+    # A function of the bytecode, the value of its declaration statement !
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+
+    def to_string(self):
+        return "<function '%s'>" % self.name
+
+
+class Bytecode:
+    """
+    A compiled program: code holds the opcodes, each followed by its operand if it takes one, the main program starting
+    at address 0 and each function body after it. constants and names are the pools the operands index, functions the
+    Function of each declaration and bindings maps a function name to the index of the Function a call runs.
+    """
+    def __init__(self, code, constants, names, functions, bindings):
+        self.code = code
+        self.constants = constants
+        self.names = names
+        self.functions = functions
+        self.bindings = bindings
+
+    def run(self, state=None):
+        return VM(self).run(state)
+
+    def disassemble(self):
+        lines = []
+        code = self.code
+        pc = 0
+        while pc < len(code):
+            op = code[pc]
+            if op < HAS_OPERAND:
+                lines.append("%5d %s" % (pc, OPNAMES[op]))
+                pc += 1
+                continue
+            arg = code[pc + 1]
+            if op == CONST:
+                detail = repr(self.constants[arg])
+            elif op in (LOAD, CHECK_LET, LET, CALL):
+                detail = self.names[arg]
+            elif op == COMPARE:
+                detail = COMPARISONS[arg].__name__
+            elif op == DECLARE:
+                detail = self.functions[arg].name
+            else:
+                detail = ""
+            lines.append("%5d %-20s %5d %s" % (pc, OPNAMES[op], arg, detail))
+            pc += 2
+        return "\n".join(lines)
+
+
+class BytecodeCompiler:
+    """
+    Compiles the AST of a program to Bytecode. Every statement and expression leaves one value on the stack, the same
+    as its eval() returns, and statements but the last of a block pop it.
+    """
+    def __init__(self):
+        self.code = array('i')
+        self.constants = []
+        self.constant_ids = {}
+        self.names = []
+        self.name_ids = {}
+        self.functions = []
+        self.function_ids = {}  # Index in functions by id of the FunctionDeclaration !
+        self.declarations = []  # The FunctionDeclaration of each Function, their bodies are compiled last !
+
+    def compile(self, main, state):
+        self.compile_node(main)
+        self.emit(HALT)
+        for declaration in state.functions.values():
+            self.function(declaration)
+        i = 0
+        while i < len(self.declarations):  # A body may declare further functions !
+            self.functions[i].address = len(self.code)
+            self.compile_node(self.declarations[i].block)
+            self.emit(RETURN)
+            i += 1
+        bindings = dict(
+            (self.name(name), self.function(declaration)) for name, declaration in state.functions.items()
+        )
+        return Bytecode(self.code, tuple(self.constants), tuple(self.names), self.functions, bindings)
+
+    def emit(self, op, arg=None):
+        self.code.append(op)
+        if arg is not None:
+            self.code.append(arg)
+        return len(self.code) - 1  # The address of the operand, to patch a jump !
+
+    def patch(self, address):
+        self.code[address] = len(self.code)
+
+    def constant(self, value):
+        key = (type(value), repr(value))  # Keeps True apart from 1 and -0.0 from 0.0 !
+        if key not in self.constant_ids:
+            self.constant_ids[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_ids[key]
+
+    def name(self, name):
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self.name_ids[name]
+
+    def function(self, declaration):
+        if id(declaration) not in self.function_ids:
+            self.function_ids[id(declaration)] = len(self.functions)
+            self.functions.append(Function(declaration.name, -1))
+            self.declarations.append(declaration)
+        return self.function_ids[id(declaration)]
+
+    def compile_node(self, node):
+        if isinstance(node, Main):
+            self.compile_node(node.program)
+        elif isinstance(node, (Program, Block)):
+            for i, statement in enumerate(node.statements):
+                if i:
+                    self.emit(POP)
+                self.compile_node(statement)
+        elif isinstance(node, StreamedProgram):
+            raise LogicError("Cannot compile a streamed program, its statements already ran")
+        elif isinstance(node, StatementFull):
+            self.compile_node(node.statement)
+        elif isinstance(node, (Statement, ExpressParenthesis)):
+            self.compile_node(node.expression)
+        elif isinstance(node, Constant):
+            self.emit(CONST, self.constant(node.value))
+        elif isinstance(node, Variable):
+            self.emit(LOAD, self.name(node.name))
+        elif isinstance(node, Assignment):
+            if not isinstance(node.left, Variable):
+                raise LogicError("Cannot assign to <%s>" % node)
+            name = self.name(node.left.get_name())
+            self.emit(CHECK_LET, name)  # Before evaluating the value, like eval() !
+            self.compile_node(node.right)
+            self.emit(LET, name)
+        elif isinstance(node, (And, Or)):
+            self.compile_node(node.left)
+            end = self.emit(JUMP_IF_FALSE_OR_POP if isinstance(node, And) else JUMP_IF_TRUE_OR_POP, -1)
+            self.compile_node(node.right)
+            self.patch(end)
+        elif isinstance(node, BinaryOp):
+            self.compile_node(node.left)
+            self.compile_node(node.right)
+            if node.operation in ARITHMETIC:
+                self.emit(ARITHMETIC[node.operation])
+            else:
+                self.emit(COMPARE, COMPARISONS.index(node.operation))
+        elif isinstance(node, Not):
+            self.compile_node(node.value)
+            self.emit(NOT)
+        elif isinstance(node, If):
+            self.compile_node(node.condition)
+            else_jump = self.emit(POP_JUMP_IF_FALSE, -1)
+            self.compile_node(node.body)
+            end = self.emit(JUMP, -1)
+            self.patch(else_jump)
+            if node.else_body is None:
+                self.emit(CONST, self.constant(None))
+            else:
+                self.compile_node(node.else_body)
+            self.patch(end)
+        elif isinstance(node, FunctionDeclaration):
+            self.emit(DECLARE, self.function(node))
+        elif isinstance(node, CallFunction):
+            self.emit(CALL, self.name(node.name))
+        elif isinstance(node, Print):
+            if node.value is None:
+                self.emit(PRINT_EMPTY)
+            else:
+                self.compile_node(node.value)
+                self.emit(PRINT)
+        elif isinstance(node, Input):
+            if node.value is None:
+                self.emit(INPUT)
+            else:
+                self.compile_node(node.value)
+                self.emit(INPUT_PROMPT)
+        elif isinstance(node, Absolute):
+            self.compile_node(node.expression)
+            self.emit(ABS)
+        elif isinstance(node, (Sin, Cos, Tan)):
+            self.compile_node(node.expression)
+            self.emit({Sin: SIN, Cos: COS, Tan: TAN}[type(node)], node.roundOffDigits)
+        elif isinstance(node, Pow):
+            self.compile_node(node.expression)
+            self.compile_node(node.expression2)
+            self.emit(POW)
+        else:
+            raise LogicError("Cannot compile <%s>" % type(node).__name__)
+
+
+class VM:
+    """
+    Runs Bytecode in a dispatch loop over its opcodes, with a stack of values and a call stack holding the return
+    address of each function call, so calls don't recurse in Python. Variables live in the ParserState it runs with.
+    The ops which run most are tested first and run inline, the rare ones are called through a table by opcode.
+    """
+    def __init__(self, bytecode):
+        self.bytecode = bytecode
+
+    def run(self, state=None):
+        if state is None:
+            state = ParserState()
+        bytecode = self.bytecode
+        code = list(bytecode.code)  # Indexing a list is faster than an array, which makes an int of each item !
+        constants = bytecode.constants
+        names = bytecode.names
+        functions = bytecode.functions
+        # The address of the function bound to each name !
+        addresses = {name: functions[function].address for name, function in bytecode.bindings.items()}
+        variables = state.variables
+        match = NUMERIC.search
+
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []  # The return address of each call !
+
+        def not_(arg):
+            if not isinstance(stack[-1], bool):
+                raise LogicError("Cannot 'not' that")
+            stack[-1] = not stack[-1]
+
+        def print_(arg):
+            print(pop())
+            push(None)
+
+        def print_empty(arg):
+            print()
+            push(None)
+
+        def input_(arg):
+            result = input()
+            push(float(result) if match(str(result)) else str(result))
+
+        def input_prompt(arg):
+            result = input(pop())
+            push(float(result) if match(str(result)) else str(result))
+
+        def abs_(arg):
+            if not match(str(stack[-1])):
+                raise ValueError("Cannot abs() not numerical values !")
+            stack[-1] = abs(stack[-1])
+
+        def pow_(arg):
+            right = pop()
+            if not (match(str(stack[-1])) and match(str(right))):
+                raise ValueError("Cannot pow() not numerical values !")
+            stack[-1] = math.pow(stack[-1], right)
+
+        def declare(arg):
+            push(functions[arg])
+
+        def math_function(function, name):
+            def handler(arg):
+                value = stack[-1]
+                if not match(str(value)):
+                    raise ValueError("Cannot %s() not numerical values !" % name)
+                stack[-1] = round(function(value), arg)
+            return handler
+
+        # The handlers of the ops which neither jump nor run often, indexed by opcode, None for the ones run inline !
+        handlers = [None] * len(OPNAMES)
+        handlers[NOT] = not_
+        handlers[PRINT] = print_
+        handlers[PRINT_EMPTY] = print_empty
+        handlers[INPUT] = input_
+        handlers[INPUT_PROMPT] = input_prompt
+        handlers[ABS] = abs_
+        handlers[POW] = pow_
+        handlers[DECLARE] = declare
+        handlers[SIN] = math_function(math.sin, 'sin')
+        handlers[COS] = math_function(math.cos, 'cos')
+        handlers[TAN] = math_function(math.tan, 'tan')
+
+        # The ops run inline are tested in the order of how often they run, CONST and LOAD being most of them !
+        pc = 0
+        while True:
+            op = code[pc]
+            if op == CONST:
+                push(constants[code[pc + 1]])
+                pc += 2
+            elif op == LOAD:
+                arg = code[pc + 1]
+                pc += 2
+                value = variables.get(names[arg])
+                if value is None:
+                    raise LogicError("Variable <%s> is not yet defined" % names[arg])
+                push(value)
+            elif op >= HAS_OPERAND:
+                arg = code[pc + 1]
+                pc += 2
+                if op == COMPARE:
+                    right = pop()
+                    stack[-1] = COMPARISONS[arg](stack[-1], right)
+                elif op == POP_JUMP_IF_FALSE:
+                    if not pop():
+                        pc = arg
+                elif op == JUMP:
+                    pc = arg
+                elif op == JUMP_IF_FALSE_OR_POP:
+                    if not stack[-1]:
+                        pc = arg
+                    else:
+                        pop()
+                elif op == CHECK_LET:
+                    if variables.get(names[arg]) is not None:
+                        raise ImmutableError(names[arg])
+                elif op == LET:
+                    variables[names[arg]] = pop()
+                    push(variables)  # Like eval(), an assignment returns the variables !
+                elif op == CALL:
+                    address = addresses.get(arg)
+                    if address is None:
+                        raise LogicError("Function <%s> is not yet defined" % names[arg])
+                    if len(frames) >= MAX_CALL_DEPTH:
+                        raise RecursionError("maximum call depth exceeded")
+                    frames.append(pc)
+                    pc = address
+                elif op == JUMP_IF_TRUE_OR_POP:
+                    if stack[-1]:
+                        pc = arg
+                    else:
+                        pop()
+                elif op < len(handlers):
+                    handlers[op](arg)
+                else:
+                    raise LogicError("Bad opcode %d at %d" % (op, pc - 2))
+            else:
+                pc += 1
+                if op == ADD:
+                    right = pop()
+                    stack[-1] = stack[-1] + right
+                elif op == POP:
+                    pop()
+                elif op == MUL:
+                    right = pop()
+                    stack[-1] = stack[-1] * right
+                elif op == SUB:
+                    right = pop()
+                    stack[-1] = stack[-1] - right
+                elif op == DIV:
+                    right = pop()
+                    stack[-1] = stack[-1] / right
+                elif op == RETURN:
+                    pc = frames.pop()
+                elif op == HALT:
+                    return pop()
+                elif op >= 0:
+                    handlers[op](None)
+                else:
+                    raise LogicError("Bad opcode %d at %d" % (op, pc - 1))
+
+
+def compile_program(main, state):
+    # The state is the ParserState the program was parsed with, which holds its functions !
+    return BytecodeCompiler().compile(main, state)
+
+
+def compile_source(source, lexer=None, parser=None):
+    state = ParserState()
+    lexer = lexer if lexer is not None else Lexer().build()
+    parser = parser if parser is not None else Parser().build()
+    return compile_program(parser.parse(lexer.lex(source), state=state), state)
+
+
+def dumps(bytecode):
+    # Only ints, strings and the constants, which marshal writes the same on every platform !
+    return marshal.dumps((
+        VERSION,
+        tuple(bytecode.code),
+        bytecode.constants,
+        bytecode.names,
+        tuple((function.name, function.address) for function in bytecode.functions),
+        tuple(bytecode.bindings.items()),
+    ))
+
+
+def loads(data):
+    data = marshal.loads(data)
+    if data[0] != VERSION:
+        raise ValueError("Unsupported bytecode version %r" % (data[0],))
+    _, code, constants, names, functions, bindings = data
+    return Bytecode(
+        array('i', code), constants, names, [Function(name, address) for name, address in functions], dict(bindings)
+    )
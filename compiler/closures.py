@@ -0,0 +1,344 @@
+import math
+import operator
+import re
+
+from compiler.AbstractSyntaxTree import *
+from compiler.errors import *
+from compiler.lexer import Lexer
+from compiler.parser import Parser, ParserState
+
+# The values accepted by the math functions, as matched by their eval() !
+NUMERIC = re.compile(r'^-?\d+(\.\d+)?$')
+
+# The closures applying each operation inline, to two operand closures or to one and the value of a constant !
+OPERATIONS = {
+    operator.add: (
+        lambda left, right: lambda state: left(state) + right(state),
+        lambda left, value: lambda state: left(state) + value,
+    ),
+    operator.sub: (
+        lambda left, right: lambda state: left(state) - right(state),
+        lambda left, value: lambda state: left(state) - value,
+    ),
+    operator.mul: (
+        lambda left, right: lambda state: left(state) * right(state),
+        lambda left, value: lambda state: left(state) * value,
+    ),
+    operator.truediv: (
+        lambda left, right: lambda state: left(state) / right(state),
+        lambda left, value: lambda state: left(state) / value,
+    ),
+    operator.eq: (
+        lambda left, right: lambda state: left(state) == right(state),
+        lambda left, value: lambda state: left(state) == value,
+    ),
+    operator.ne: (
+        lambda left, right: lambda state: left(state) != right(state),
+        lambda left, value: lambda state: left(state) != value,
+    ),
+    operator.gt: (
+        lambda left, right: lambda state: left(state) > right(state),
+        lambda left, value: lambda state: left(state) > value,
+    ),
+    operator.lt: (
+        lambda left, right: lambda state: left(state) < right(state),
+        lambda left, value: lambda state: left(state) < value,
+    ),
+    operator.ge: (
+        lambda left, right: lambda state: left(state) >= right(state),
+        lambda left, value: lambda state: left(state) >= value,
+    ),
+    operator.le: (
+        lambda left, right: lambda state: left(state) <= right(state),
+        lambda left, value: lambda state: left(state) <= value,
+    ),
+}
+
+
+class Compiler:
+    """
+    Turns an AST into nested closures taking the ParserState to run with, each bound to the closures of its children,
+    so running it again doesn't walk the AST. The closures behave like eval() without a node, which stays the
+    reference implementation. The body of a function is compiled on its first call, since it may call itself.
+    """
+    def __init__(self):
+        self.blocks = {}  # (FunctionDeclaration, compiled block) by id of the declaration !
+        # The compile method of each AST class, subclasses are looked up along their MRO once !
+        self.compilers = {
+            Main: self.compile_main,
+            Program: self.compile_statements,
+            Block: self.compile_statements,
+            StreamedProgram: self.compile_streamed,
+            StatementFull: self.compile_statement_full,
+            Statement: self.compile_expression,
+            ExpressParenthesis: self.compile_expression,
+            If: self.compile_if,
+            Variable: self.compile_variable,
+            Assignment: self.compile_assignment,
+            FunctionDeclaration: self.compile_function_declaration,
+            CallFunction: self.compile_call,
+            Constant: self.compile_constant,
+            BinaryOp: self.compile_binary_op,
+            And: self.compile_and,
+            Or: self.compile_or,
+            Not: self.compile_not,
+            Absolute: self.compile_absolute,
+            Sin: self.compile_sin,
+            Cos: self.compile_cos,
+            Tan: self.compile_tan,
+            Pow: self.compile_pow,
+            Print: self.compile_print,
+            Input: self.compile_input,
+        }
+
+    def compile(self, node):
+        compile_node = self.compilers.get(type(node))
+        if compile_node is None:
+            for cls in type(node).__mro__:
+                if cls in self.compilers:
+                    compile_node = self.compilers[type(node)] = self.compilers[cls]
+                    break
+            else:
+                raise LogicError("Cannot compile <%s>" % type(node).__name__)
+        return compile_node(node)
+
+    def block(self, declaration):
+        entry = self.blocks.get(id(declaration))
+        if entry is None:
+            entry = self.blocks[id(declaration)] = declaration, self.compile(declaration.block)
+        return entry[1]
+
+    def compile_main(self, node):
+        return self.compile(node.program)
+
+    def compile_statements(self, node):
+        statements = tuple(self.compile(statement) for statement in node.statements)
+        if len(statements) == 1:
+            return statements[0]
+
+        def run(state):
+            result = None
+            for statement in statements:
+                result = statement(state)
+            return result
+        return run
+
+    def compile_streamed(self, node):
+        raise LogicError("Cannot compile a streamed program, its statements already ran")
+
+    def compile_statement_full(self, node):
+        return self.compile(node.statement)
+
+    def compile_expression(self, node):
+        return self.compile(node.expression)
+
+    def compile_if(self, node):
+        condition = self.compile(node.condition)
+        body = self.compile(node.body)
+        if node.else_body is None:
+            def run(state):
+                if bool(condition(state)) is True:
+                    return body(state)
+                return None
+            return run
+        else_body = self.compile(node.else_body)
+
+        def run_else(state):
+            if bool(condition(state)) is True:
+                return body(state)
+            return else_body(state)
+        return run_else
+
+    def compile_variable(self, node):
+        name = node.name
+        message = "Variable <%s> is not yet defined" % name
+
+        def run(state):
+            value = state.variables.get(name)
+            if value is None:
+                raise LogicError(message)
+            return value
+        return run
+
+    def compile_assignment(self, node):
+        if not isinstance(node.left, Variable):
+            message = "Cannot assign to <%s>" % node
+
+            def fail(state):
+                raise LogicError(message)
+            return fail
+        name = node.left.get_name()
+        right = self.compile(node.right)
+
+        def run(state):
+            variables = state.variables
+            if variables.get(name) is None:
+                variables[name] = right(state)
+                return variables  # Like eval(), return the variables !
+            raise ImmutableError(name)
+        return run
+
+    def compile_function_declaration(self, node):
+        # Declared while parsing, running the declaration only returns it !
+        return lambda state: node
+
+    def compile_call(self, node):
+        name = node.name
+        message = "Function <%s> is not yet defined" % name
+        block = self.block
+
+        def run(state):
+            functions = state.functions
+            if name not in functions:
+                raise LogicError(message)
+            return block(functions[name])(state)
+        return run
+
+    def compile_constant(self, node):
+        value = node.value
+        return lambda state: value
+
+    def compile_binary_op(self, node):
+        operation = node.operation
+        left = self.compile(node.left)
+        if operation not in OPERATIONS:
+            right = self.compile(node.right)
+            return lambda state: operation(left(state), right(state))
+        both, constant = OPERATIONS[operation]
+        if isinstance(node.right, Constant):
+            return constant(left, node.right.value)
+        return both(left, self.compile(node.right))
+
+    def compile_and(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        return lambda state: left(state) and right(state)
+
+    def compile_or(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        return lambda state: left(state) or right(state)
+
+    def compile_not(self, node):
+        expression = self.compile(node.value)
+
+        def run(state):
+            value = expression(state)
+            if isinstance(value, bool):
+                return not value
+            raise LogicError("Cannot 'not' that")
+        return run
+
+    def compile_numeric(self, expression, function, message):
+        # A math function of one numerical value !
+        expression = self.compile(expression)
+        match = NUMERIC.search
+
+        def run(state):
+            value = expression(state)
+            if match(str(value)):
+                return function(value)
+            raise ValueError(message)
+        return run
+
+    def compile_absolute(self, node):
+        return self.compile_numeric(node.expression, abs, "Cannot abs() not numerical values !")
+
+    def compile_sin(self, node):
+        digits = node.roundOffDigits
+        return self.compile_numeric(
+            node.expression, lambda value: round(math.sin(value), digits), "Cannot sin() not numerical values !"
+        )
+
+    def compile_cos(self, node):
+        digits = node.roundOffDigits
+        return self.compile_numeric(
+            node.expression, lambda value: round(math.cos(value), digits), "Cannot cos() not numerical values !"
+        )
+
+    def compile_tan(self, node):
+        digits = node.roundOffDigits
+        return self.compile_numeric(
+            node.expression, lambda value: round(math.tan(value), digits), "Cannot tan() not numerical values !"
+        )
+
+    def compile_pow(self, node):
+        expression = self.compile(node.expression)
+        expression2 = self.compile(node.expression2)
+        match = NUMERIC.search
+
+        def run(state):
+            value = expression(state)
+            value2 = expression2(state)
+            if match(str(value)) and match(str(value2)):
+                return math.pow(value, value2)
+            raise ValueError("Cannot pow() not numerical values !")
+        return run
+
+    def compile_print(self, node):
+        if node.value is None:
+            def run(state):
+                print()
+            return run
+        expression = self.compile(node.value)
+
+        def run_expression(state):
+            print(expression(state))
+        return run_expression
+
+    def compile_input(self, node):
+        if node.value is None:
+            prompt = None
+        else:
+            prompt = self.compile(node.value)
+        match = NUMERIC.search
+
+        def run(state):
+            result = input() if prompt is None else input(prompt(state))
+            if match(str(result)):
+                return float(result)
+            return str(result)
+        return run
+
+
+class CompiledProgram:
+    """
+    A parsed program compiled once by the Compiler, to be run many times. Each run without a state starts from no
+    variables and the functions declared while parsing, so a program assigning its variables with 'let' can run again.
+    """
+    def __init__(self, main, state):
+        self.compiler = Compiler()
+        self.code = self.compiler.compile(main)
+        self.functions = dict(state.functions)
+
+    def run(self, state=None):
+        if state is None:
+            state = ParserState()
+            state.functions.update(self.functions)
+        return self.code(state)
+
+
+def compile_program(main, state):
+    # The state is the ParserState the program was parsed with, which holds its functions !
+    return CompiledProgram(main, state)
+
+
+class ProgramCache:
+    """
+    The CompiledProgram of each source, so running the same source again skips lexing, parsing and compiling.
+    """
+    def __init__(self, lexer=None, parser=None):
+        self.lexer = lexer if lexer is not None else Lexer().build()
+        self.parser = parser if parser is not None else Parser().build()
+        self.programs = {}
+
+    def get(self, source):
+        program = self.programs.get(source)
+        if program is None:
+            state = ParserState()
+            main = self.parser.parse(self.lexer.lex(source), state=state)
+            program = self.programs[source] = compile_program(main, state)
+        return program
+
+    def run(self, source, state=None):
+        return self.get(source).run(state)
@@ -0,0 +1,8 @@
+import os
+from compiler.parser import Parser
+from rply.codegen import write_module
+
+# Run with "python -m compiler.generate_parsetab" whenever the grammar changes !
+path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parsetab.py")
+write_module(Parser().pg, path)
+print("Wrote " + path)
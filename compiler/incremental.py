@@ -0,0 +1,366 @@
+import random
+
+from rply import LexingError
+from rply.parser import ParseLog
+from compiler.lexer import Lexer
+from compiler.parser import Parser, ParserState
+from compiler.AbstractSyntaxTree import Main, Program
+
+
+# The declared functions of a ParserState, reporting each declaration while a unit is parsed !
+class FunctionTable(dict):
+    def __init__(self):
+        dict.__init__(self)
+        self.recorder = None
+        self.changed = set()  # The names declared since it was last cleared !
+
+    def __setitem__(self, name, function):
+        dict.__setitem__(self, name, function)
+        self.changed.add(name)
+        if self.recorder is not None:
+            self.recorder(name, function)
+
+
+# Consecutive top-level statements spanning whole lines of the source, with the text of these lines !
+class Unit(object):
+    def __init__(self, text, statements, functions):
+        self.text = text
+        self.statements = statements
+        self.functions = functions  # (name, FunctionDeclaration) in declaration order !
+        self.node = None  # Its UnitNode in the tree of units !
+
+
+# A node of the treap holding the units in source order, keeping the number of units, characters and statements of
+# its subtree, so a unit is found by index or position in O(log n) !
+class UnitNode(object):
+    def __init__(self, unit):
+        self.unit = unit
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.size = 1
+        self.length = len(unit.text)
+        self.count = len(unit.statements)
+        unit.node = self
+
+
+def update(node):
+    node.size = 1
+    node.length = len(node.unit.text)
+    node.count = len(node.unit.statements)
+    for child in (node.left, node.right):
+        if child is not None:
+            child.parent = node
+            node.size += child.size
+            node.length += child.length
+            node.count += child.count
+
+
+def merge(a, b):
+    # The treap of the units of a followed by those of b !
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = merge(a.right, b)
+        update(a)
+        return a
+    b.left = merge(a, b.left)
+    update(b)
+    return b
+
+
+def split(node, k):
+    # The treaps of the first k units of node and of the others !
+    if node is None:
+        return None, None
+    left_size = node.left.size if node.left is not None else 0
+    if k <= left_size:
+        first, node.left = split(node.left, k)
+        update(node)
+        if first is not None:
+            first.parent = None
+        return first, node
+    node.right, rest = split(node.right, k - left_size - 1)
+    update(node)
+    if rest is not None:
+        rest.parent = None
+    return node, rest
+
+
+def build(units):
+    tree = None
+    for unit in units:
+        tree = merge(tree, UnitNode(unit))
+    if tree is not None:
+        tree.parent = None
+    return tree
+
+
+def units_of(node):
+    # The units of a treap in source order !
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+        else:
+            node = stack.pop()
+            yield node.unit
+            node = node.right
+
+
+def prefix(node, k):
+    # The number of characters and of statements in the first k units !
+    length = count = 0
+    while node is not None:
+        left = node.left
+        left_size = left.size if left is not None else 0
+        if k <= left_size:
+            node = left
+            continue
+        if left is not None:
+            length += left.length
+            count += left.count
+        if k == left_size:
+            break
+        length += len(node.unit.text)
+        count += len(node.unit.statements)
+        k -= left_size + 1
+        node = node.right
+    return length, count
+
+
+def count_ending_before(node, position):
+    # The number of units ending before position !
+    count = offset = 0
+    while node is not None:
+        left = node.left
+        start = offset + (left.length if left is not None else 0)
+        if start + len(node.unit.text) < position:
+            count += (left.size if left is not None else 0) + 1
+            offset = start + len(node.unit.text)
+            node = node.right
+        else:
+            node = left
+    return count
+
+
+def count_starting_by(node, position):
+    # The number of units starting at or before position !
+    count = offset = 0
+    while node is not None:
+        left = node.left
+        start = offset + (left.length if left is not None else 0)
+        if start <= position:
+            count += (left.size if left is not None else 0) + 1
+            offset = start + len(node.unit.text)
+            node = node.right
+        else:
+            node = left
+    return count
+
+
+def unit_at(node, k):
+    while True:
+        left_size = node.left.size if node.left is not None else 0
+        if k < left_size:
+            node = node.left
+        elif k == left_size:
+            return node
+        else:
+            k -= left_size + 1
+            node = node.right
+
+
+def successor(node):
+    if node.right is not None:
+        node = node.right
+        while node.left is not None:
+            node = node.left
+        return node
+    while node.parent is not None and node.parent.right is node:
+        node = node.parent
+    return node.parent
+
+
+def rank(node):
+    # The index of the unit of node in source order !
+    k = node.left.size if node.left is not None else 0
+    while node.parent is not None:
+        if node.parent.right is node:
+            k += (node.parent.left.size if node.parent.left is not None else 0) + 1
+        node = node.parent
+    return k
+
+
+class IncrementalParser:
+    """
+    Keeps the source split into units of whole lines holding one or more top-level statements. A token never spans
+    a line, so a unit lexes and parses the same on its own as in the whole source. An edit only relexes and reparses
+    the units it touches, growing the damaged region while it doesn't parse, e.g. after an unclosed '{'. If even the
+    whole source doesn't parse, the error is raised and the edit isn't applied.
+
+    The units are kept in a treap by their length, so finding the units an edit touches, and replacing them, takes
+    O(log n) besides parsing them. The statements of the program and the declared functions are only updated for the
+    units replaced, the program returned being the same one updated in place.
+    """
+    def __init__(self):
+        self.lexer = Lexer().build()
+        self.parser = Parser().build()
+        self.state = ParserState()
+        self.state.functions = FunctionTable()
+        self.tree = None
+        self.main = None
+        self.declarations = {}  # The units declaring each function name !
+
+    @property
+    def source(self):
+        return "".join(unit.text for unit in units_of(self.tree))
+
+    def __len__(self):
+        return self.tree.length if self.tree is not None else 0
+
+    def parse(self, source):
+        functions = self.state.functions
+        functions.changed.clear()
+        try:
+            units = self.parse_units(source)
+        except (LexingError, ValueError):
+            self.redeclare(functions.changed)  # Forgets the functions the failed parse declared !
+            raise
+        self.tree = build(units)
+        self.declarations = {}
+        dict.clear(functions)
+        for unit in units:
+            self.declare(unit)
+            for name, function in unit.functions:  # A later declaration wins, like in a full parse !
+                dict.__setitem__(functions, name, function)
+        statements = [statement for unit in units for statement in unit.statements]
+        program = Program(statements[0], self.state)
+        program.statements = statements
+        self.main = Main(program)
+        return self.main
+
+    def edit(self, start, end, text):
+        # Replaces source[start:end] with text, then returns the program !
+        if not 0 <= start <= end <= len(self):
+            raise IndexError("Edit [%d, %d) is outside the source" % (start, end))
+        if self.tree is None:  # Nothing parsed yet, so nothing to reuse !
+            return self.parse(text)
+        n = self.tree.size
+        # A unit merely touching the edit is damaged as well, the edit may extend its last line !
+        first = min(count_ending_before(self.tree, start), n - 1)
+        last = max(first, min(count_starting_by(self.tree, end), n) - 1)
+        functions = self.state.functions
+        functions.changed.clear()
+        while True:
+            lo = prefix(self.tree, first)[0]
+            node = unit_at(self.tree, first)
+            damaged = []
+            for _ in range(last - first + 1):
+                damaged.append(node.unit.text)
+                node = successor(node)
+            damaged = "".join(damaged)
+            try:
+                new_units = self.parse_units(damaged[:start - lo] + text + damaged[end - lo:])
+                break
+            except (LexingError, ValueError):
+                if first == 0 and last == n - 1:
+                    self.redeclare(functions.changed)
+                    raise
+                # Doubling the region keeps the total work linear, when the error only goes away with the whole file !
+                size = last - first + 1
+                first = max(first - size, 0)
+                last = min(last + size, n - 1)
+        before, rest = split(self.tree, first)
+        removed, after = split(rest, last - first + 1)
+        removed_count = removed.count
+        removed = list(units_of(removed))
+        statement_index = before.count if before is not None else 0
+        self.tree = merge(merge(before, build(new_units)), after)
+        self.tree.parent = None
+        self.main.program.statements[statement_index:statement_index + removed_count] = [
+            statement for unit in new_units for statement in unit.statements
+        ]
+        names = set(functions.changed)
+        for unit in removed:
+            self.undeclare(unit)
+            names.update(name for name, function in unit.functions)
+        for unit in new_units:
+            self.declare(unit)
+        self.redeclare(names)
+        return self.main
+
+    def parse_units(self, text):
+        log = ParseLog()
+        declared = []
+        functions = self.state.functions
+        functions.recorder = lambda name, function: declared.append((len(log.events), name, function))
+        try:
+            program = self.parser.parse(self.lexer.lex(text), state=self.state, log=log).program
+        finally:
+            functions.recorder = None
+        # Each reduction of a program production ends a top-level statement !
+        ends = []  # (event index, number of tokens shifted) after each statement !
+        shifted = 0
+        productions = log.grammar.productions
+        for i, event in enumerate(log.events):
+            if event < 0:
+                shifted += 1
+            elif productions[event].name == 'program':
+                ends.append((i, shifted))
+        tokens = log.tokens
+        units = []
+        unit_start = 0
+        first_statement = 0
+        for k, (event, shifted) in enumerate(ends):
+            last_token = tokens[shifted - 1]
+            token_end = last_token.source_pos.idx + len(last_token.value)
+            if k + 1 < len(ends):
+                gap_end = tokens[shifted].source_pos.idx
+            else:
+                gap_end = len(text)
+            newline = text.find("\n", token_end, gap_end)
+            if k + 1 < len(ends) and newline < 0:
+                continue  # The next statement starts on the same line !
+            unit_end = newline + 1 if k + 1 < len(ends) else len(text)
+            first_event = ends[first_statement - 1][0] if first_statement else -1
+            units.append(Unit(
+                text[unit_start:unit_end], program.statements[first_statement:k + 1],
+                [(name, function) for position, name, function in declared if first_event < position <= event]
+            ))
+            unit_start = unit_end
+            first_statement = k + 1
+        return units
+
+    def declare(self, unit):
+        for name, function in unit.functions:
+            self.declarations.setdefault(name, set()).add(unit)
+
+    def undeclare(self, unit):
+        for name, function in unit.functions:
+            units = self.declarations.get(name)
+            if units is not None:
+                units.discard(unit)
+                if not units:
+                    del self.declarations[name]
+
+    def redeclare(self, names):
+        # The last declaration of each name wins, like in a full parse !
+        functions = self.state.functions
+        for name in names:
+            units = self.declarations.get(name)
+            if not units:
+                dict.pop(functions, name, None)
+                continue
+            unit = max(units, key=lambda unit: rank(unit.node))
+            for declared, function in reversed(unit.functions):
+                if declared == name:
+                    dict.__setitem__(functions, name, function)
+                    break
+
+    def program(self):
+        return self.main
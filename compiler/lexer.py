@@ -1,4 +1,13 @@
-from rply import LexerGenerator
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from rply import LexerGenerator, LexingError
+from rply.lexer import TokenBuffer
+from rply.token import LazySourcePosition
+
+# A statement ends with one of these, which never occur inside another token but a string !
+STATEMENT_END = re.compile(r'[;}]')
 
 
 class Lexer:
@@ -13,15 +22,12 @@ class Lexer:
         self.lexer.add('FLOAT', r'-?\d+\.\d+')
         self.lexer.add('INTEGER', r'-?\d+')
         self.lexer.add('STRING', r'(""".*""")|(".*")|(\'.*\')')
-        self.lexer.add('BOOLEAN', r'true(?!\w)|false(?!\w)|True(?!\w)|False(?!\w)|TRUE(?!\w)|FALSE(?!\w)')
         # Mathematical Operators
         self.lexer.add('SUM', r'\+')
         self.lexer.add('SUB', r'\-')
         self.lexer.add('MUL', r'\*')
         self.lexer.add('DIV', r'\/')
         # Binary Operator
-        self.lexer.add('AND', r'and(?!\w)')
-        self.lexer.add('OR', r'or(?!\w)')
         self.lexer.add('==', r'\=\=')
         self.lexer.add('!=', r'\!\=')
         self.lexer.add('>=', r'\>\=')
@@ -29,10 +35,6 @@ class Lexer:
         self.lexer.add('>', r'\>')
         self.lexer.add('<', r'\<')
         self.lexer.add('=', r'\=')
-        # Statement
-        self.lexer.add('IF', r'if(?!\w)')
-        self.lexer.add('ELSE', r'else(?!\w)')
-        self.lexer.add('NOT', r'not(?!\w)')
         # Semi Colon
         self.lexer.add(';', r'\;')
         self.lexer.add(',', r'\,')
@@ -41,22 +43,143 @@ class Lexer:
         self.lexer.add(')', r'\)')
         self.lexer.add('{', r'\{')
         self.lexer.add('}', r'\}')
-        # Function
-        self.lexer.add('CONSOLE_INPUT', r'input')
-        self.lexer.add('FUNCTION', r'function')
-        self.lexer.add('PRINT', r'print')
-        self.lexer.add('ABSOLUTE', r'abs')
-        self.lexer.add('SIN', r'sin')
-        self.lexer.add('COS', r'cos')
-        self.lexer.add('TAN', r'tan')
-        self.lexer.add('POWER', r'pow')
-        # Assignment
-        self.lexer.add('LET', r'let(?!\w)')
+        # Identifier
         self.lexer.add('IDENTIFIER', "[a-zA-Z_][a-zA-Z0-9_]*")
+        # Keywords are matched as identifiers, then looked up in this table !
+        self.lexer.add_keywords('IDENTIFIER', {
+            # Constant
+            'true': 'BOOLEAN', 'True': 'BOOLEAN', 'TRUE': 'BOOLEAN',
+            'false': 'BOOLEAN', 'False': 'BOOLEAN', 'FALSE': 'BOOLEAN',
+            # Binary Operator
+            'and': 'AND',
+            'or': 'OR',
+            # Statement
+            'if': 'IF',
+            'else': 'ELSE',
+            'not': 'NOT',
+            # Function
+            'input': 'CONSOLE_INPUT',
+            'function': 'FUNCTION',
+            'print': 'PRINT',
+            'abs': 'ABSOLUTE',
+            'sin': 'SIN',
+            'cos': 'COS',
+            'tan': 'TAN',
+            'pow': 'POWER',
+            # Assignment
+            'let': 'LET',
+        })
         # Ignore spaces
         self.lexer.ignore('\s+')
 
         # self.lexer.add('OPT_LINE', r'\n*')
 
-    def build(self):
-        return self.lexer.build()
+    def build(self, profile=None):
+        # A profile recorded by profile() puts the most frequent tokens first, where they don't conflict !
+        return self.lexer.build(combined=True, profile=profile)
+
+    def profile(self, source):
+        lexer = self.lexer.build(instrument=True)
+        for _ in lexer.lex(source):
+            pass
+        return lexer.profile
+
+    def build_dfa(self):
+        return self.lexer.build_dfa(cache_id="compiler-lexer")
+
+    def token_names(self):
+        names = []
+        for rule in self.lexer.rules:
+            if rule.name not in names:
+                names.append(rule.name)
+        for keywords in self.lexer.keywords.values():
+            for name in keywords.values():
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def lex_parallel(self, source, workers=None, chunk_size=1 << 20, executor=None):
+        """
+        Lex a large source on several processes, returning the same TokenBuffer as a serial run.
+        The source is cut into chunks of about chunk_size characters at safe cut points (see cut_points).
+        """
+        cuts = cut_points(source, chunk_size)
+        if len(cuts) == 2:  # Too small or no safe cut point, lex serially !
+            return self.build().lex(source, buffered=True)
+        names = self.token_names()
+        jobs = []
+        lineno = 1
+        for start, end in zip(cuts, cuts[1:]):
+            jobs.append((type(self), source[start:end], start, lineno, names))
+            lineno += source.count("\n", start, end)
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lex_chunk, jobs))
+        else:
+            results = list(executor.map(lex_chunk, jobs))
+
+        tokens = TokenBuffer(source)
+        for name in names:
+            tokens.add_name(name)
+        for result in results:
+            if result[0] == "error":
+                raise LexingError(None, LazySourcePosition(result[1], tokens.lines))
+            types, starts, ends, linenos = result
+            tokens.types.extend(types)
+            tokens.starts.extend(starts)
+            tokens.ends.extend(ends)
+            tokens.linenos.extend(linenos)
+        return tokens
+
+
+def cut_points(source, chunk_size):
+    """
+    Returns the indices at which source can be cut into chunks of about chunk_size characters, including 0 and len(source).
+    A safe cut point follows a top-level ';' or '}' with no quote after it on the same line: a string never spans lines,
+    so such a character can't be part of a string and always ends a token.
+    """
+    cuts = [0]
+    depth = 0  # Brace depth at index counted !
+    counted = 0
+    target = chunk_size
+    while target < len(source):
+        match = STATEMENT_END.search(source, target)
+        if match is None:
+            break
+        cut = match.end()
+        depth += source.count("{", counted, cut) - source.count("}", counted, cut)
+        counted = cut
+        line_end = source.find("\n", cut)
+        if line_end < 0:
+            line_end = len(source)
+        if depth <= 0 and source.find('"', cut, line_end) < 0 and source.find("'", cut, line_end) < 0:
+            cuts.append(cut)
+            target = cut + chunk_size
+        else:
+            target = cut
+    cuts.append(len(source))
+    return cuts
+
+
+_chunk_lexers = {}  # Lexers built by a worker process, by Lexer class !
+
+
+def lex_chunk(job):
+    """
+    Lex one chunk in a worker process, returning the columns of its tokens with indices and line numbers
+    relative to the whole source, or ("error", index) if the chunk can't be lexed.
+    """
+    lexer_class, chunk, base, lineno, names = job
+    if lexer_class not in _chunk_lexers:
+        _chunk_lexers[lexer_class] = lexer_class().build()
+    try:
+        tokens = _chunk_lexers[lexer_class].lex(chunk, buffered=True)
+    except LexingError as e:
+        return "error", base + e.getsourcepos().idx
+    type_ids = [names.index(name) for name in tokens.names]
+    return (
+        array("i", [type_ids[t] for t in tokens.types]),
+        array("i", [start + base for start in tokens.starts]),
+        array("i", [end + base for end in tokens.ends]),
+        array("i", [line + lineno - 1 for line in tokens.linenos]),
+    )
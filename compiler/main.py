@@ -1,9 +1,11 @@
 from compiler.lexer import Lexer
-from compiler.parser import Parser, ParserState
+from compiler.parser import Parser, ParserState, syntax_tree
 from compiler.JSONparsedTree import Node, write
-from rply.lexer import LexerStream
-from copy import copy
+from compiler.optimizer import optimize
+from rply.lexer import TokenBuffer
+from rply.parser import ParseLog
 from pprint import pprint
+import sys
 import traceback
 
 basic_assignment = """
@@ -69,15 +71,18 @@ function main() {
 main();
 """
 
+# Run with --optimize to fold constants & remove dead branches before evaluating, which changes the semantic tree !
+optimizeProgram = "--optimize" in sys.argv[1:]
+
 lexer = Lexer().build()  # Build the lexer using LexerGenerator
-tokens: LexerStream
+tokens: TokenBuffer
 try:
-    tokens = lexer.lex(call_declared_functions)  # Stream the input to analysis the lexical syntax
-    tokenType = map(lambda x: x.gettokentype(), copy(tokens))
-    tokenName = map(lambda x: x.getstr(), copy(tokens))
-    pprint(list(copy(tokens)))
-    # pprint(list(copy(tokenType)))
-    # pprint(list(copy(tokenName)))
+    tokens = lexer.lex(call_declared_functions, buffered=True)  # Lex the input once, the buffer can be iterated again !
+    tokenType = map(lambda x: x.gettokentype(), tokens)
+    tokenName = map(lambda x: x.getstr(), tokens)
+    pprint(list(tokens))
+    # pprint(list(tokenType))
+    # pprint(list(tokenName))
 except (BaseException, Exception):
     traceback.print_exc()
 finally:
@@ -87,8 +92,14 @@ SymbolTable = ParserState()
 syntaxRoot: Node
 semanticRoot = Node("main")
 try:
-    syntaxRoot = Node("main", Parser(syntax=True).build().parse(copy(tokens), state=SymbolTable))  # Get syntax tree !
-    Parser().build().parse(copy(tokens), state=SymbolTable).eval(semanticRoot)  # Get semantic tree !
+    log = ParseLog()  # Records the shifts & reductions, which make up the syntax tree !
+    program = Parser().build().parse(tokens, state=SymbolTable, log=log)  # Parse once for both trees !
+    syntaxRoot = Node("main", syntax_tree(log))  # Get syntax tree !
+    if optimizeProgram:
+        program, report = optimize(program, SymbolTable)
+        print("------------------------------Optimizations:------------------------------")
+        pprint(report)
+    program.eval(semanticRoot)  # Get semantic tree, program.eval() would only run the program without recording it !
 except (BaseException, Exception):
     traceback.print_exc()
 finally:
@@ -0,0 +1,176 @@
+import math
+import re
+
+from compiler.AbstractSyntaxTree import *
+
+# The values accepted by the math functions, as matched by their eval() !
+NUMERIC = re.compile(r'^-?\d+(\.\d+)?$')
+
+MATH_FUNCTIONS = {Sin: math.sin, Cos: math.cos, Tan: math.tan}
+
+
+def make_constant(value, state):
+    # The Constant node eval() would return value from, None if there is none !
+    if isinstance(value, bool):
+        return Boolean("true" if value else "false", state)
+    if isinstance(value, int):
+        return Integer(value, state)
+    if isinstance(value, float):
+        return Float(value, state)
+    if isinstance(value, str):
+        return String(value, state)
+    return None
+
+
+class Optimizer:
+    """
+    A pass over the AST between parsing and evaluation, which changes it in place without changing what it prints,
+    returns or raises:
+    - Constant subtrees of BinaryOp, And, Or, Not and the math functions are folded into one Constant. A subtree which
+      would raise, e.g. 1 / 0, is left for eval() to raise.
+    - A variable assigned a constant with 'let' is replaced by that constant in the statements after the assignment
+      in the same block, since variables are immutable. A failing assignment stops the program, so it never reaches
+      them otherwise.
+    - An If on a constant condition is replaced by the statements of the branch it takes, or dropped if it takes
+      none and isn't the last statement, whose value the block returns.
+    Each change is described in report.
+    """
+    def __init__(self, state):
+        self.state = state
+        self.report = []
+        self.declarations = set()  # The ids of the optimized FunctionDeclarations !
+
+    def optimize(self, main):
+        main.program.statements = self.statements(main.program.statements, {})
+        for declaration in self.state.functions.values():
+            if id(declaration) not in self.declarations:  # Declared in a removed branch !
+                self.declaration(declaration)
+        return main
+
+    def declaration(self, declaration):
+        # Its block may run before any statement of the block declaring it, without their constants !
+        self.declarations.add(id(declaration))
+        declaration.block.statements = self.statements(declaration.block.statements, {})
+
+    def statements(self, statements, constants):
+        # constants maps the variables assigned a constant so far in this block to their Constant !
+        statements = list(statements)
+        i = 0
+        while i < len(statements):
+            statement = statements[i]
+            if isinstance(statement, If):
+                statement.condition = self.expression(statement.condition, constants)
+                if isinstance(statement.condition, Constant):
+                    taken = statement.body if bool(statement.condition.value) is True else statement.else_body
+                    condition = statement.condition.value
+                    if taken is statement.body:
+                        self.report.append("Replaced an If on %r by its body%s" % (
+                            condition, "" if statement.else_body is None else ", removing its else branch"
+                        ))
+                    elif taken is not None:
+                        self.report.append("Replaced an If on %r by its else branch, removing its body" % (condition,))
+                    if taken is not None:
+                        statements[i:i + 1] = taken.statements  # Optimized in this block's scope next !
+                        continue
+                    if i < len(statements) - 1:
+                        self.report.append("Removed an If on %r, which has no else branch" % (condition,))
+                        del statements[i]
+                        continue
+                    # Kept as the last statement, its value is the block's !
+                    statement.body.statements = self.statements(statement.body.statements, dict(constants))
+                    i += 1
+                    continue
+                statement.body.statements = self.statements(statement.body.statements, dict(constants))
+                if statement.else_body is not None:
+                    statement.else_body.statements = self.statements(statement.else_body.statements, dict(constants))
+            elif isinstance(statement, FunctionDeclaration):
+                self.declaration(statement)
+            elif isinstance(statement, StatementFull):
+                self.statement(statement.statement, constants)
+            i += 1
+        return statements
+
+    def statement(self, node, constants):
+        if isinstance(node, Assignment):
+            node.right = self.expression(node.right, constants)
+            if isinstance(node.left, Variable) and isinstance(node.right, Constant):
+                constants.setdefault(node.left.get_name(), node.right)
+        elif isinstance(node, Statement):
+            node.expression = self.expression(node.expression, constants)
+        elif isinstance(node, Print) and node.value is not None:
+            node.value = self.expression(node.value, constants)
+
+    def expression(self, node, constants):
+        if isinstance(node, Variable):
+            constant = constants.get(node.name)
+            if constant is None:
+                return node
+            self.report.append("Replaced variable <%s> by %r" % (node.name, constant.value))
+            return make_constant(constant.value, self.state)
+        if isinstance(node, ExpressParenthesis):
+            node.expression = self.expression(node.expression, constants)
+            return node.expression if isinstance(node.expression, Constant) else node
+        if isinstance(node, (And, Or)):
+            node.left = self.expression(node.left, constants)
+            node.right = self.expression(node.right, constants)
+            if not isinstance(node.left, Constant):
+                return node
+            # The left operand decides if the right one is evaluated at all !
+            if bool(node.left.value) is isinstance(node, Or):
+                self.report.append("Folded %s on %r, removing its right operand" % (
+                    type(node).__name__, node.left.value
+                ))
+                return node.left
+            self.report.append("Folded %s on %r into its right operand" % (type(node).__name__, node.left.value))
+            return node.right
+        if isinstance(node, BinaryOp):
+            node.left = self.expression(node.left, constants)
+            node.right = self.expression(node.right, constants)
+            if isinstance(node.left, Constant) and isinstance(node.right, Constant):
+                return self.fold(node, node.operation, node.left.value, node.right.value)
+            return node
+        if isinstance(node, Not):
+            node.value = self.expression(node.value, constants)
+            if isinstance(node.value, Constant) and isinstance(node.value.value, bool):
+                return self.fold(node, lambda value: not value, node.value.value)
+            return node
+        if isinstance(node, (Absolute, Sin, Cos, Tan)):
+            node.expression = self.expression(node.expression, constants)
+            if isinstance(node.expression, Constant) and NUMERIC.search(str(node.expression.value)):
+                if isinstance(node, Absolute):
+                    return self.fold(node, abs, node.expression.value)
+                function = MATH_FUNCTIONS[type(node)]
+                return self.fold(
+                    node, lambda value: round(function(value), node.roundOffDigits), node.expression.value
+                )
+            return node
+        if isinstance(node, Pow):
+            node.expression = self.expression(node.expression, constants)
+            node.expression2 = self.expression(node.expression2, constants)
+            if isinstance(node.expression, Constant) and isinstance(node.expression2, Constant):
+                value, value2 = node.expression.value, node.expression2.value
+                if NUMERIC.search(str(value)) and NUMERIC.search(str(value2)):
+                    return self.fold(node, math.pow, value, value2)
+            return node
+        if isinstance(node, Input) and node.value is not None:
+            node.value = self.expression(node.value, constants)
+        return node
+
+    def fold(self, node, function, *values):
+        try:
+            value = function(*values)
+        except (ArithmeticError, TypeError, ValueError):
+            return node  # Raised again by eval(), when it runs !
+        constant = make_constant(value, self.state)
+        if constant is None:
+            return node
+        self.report.append("Folded %s of %s into %r" % (
+            type(node).__name__, ", ".join(repr(value) for value in values), value
+        ))
+        return constant
+
+
+def optimize(main, state):
+    # Returns the optimized program and the report of what was folded or removed !
+    optimizer = Optimizer(state)
+    return optimizer.optimize(main), optimizer.report
@@ -0,0 +1,287 @@
+import ast
+import math
+import operator
+import re
+
+from compiler.AbstractSyntaxTree import *
+from compiler.errors import *
+from compiler.lexer import Lexer
+from compiler.parser import Parser, ParserState
+
+# The values accepted by the math functions, as matched by their eval() !
+NUMERIC = re.compile(r'^-?\d+(\.\d+)?$')
+
+# The names the generated code is compiled with, besides V for the variables and _fn_<name> for the functions !
+FUNCTION_PREFIX = "_fn_"
+
+
+def _is_numeric(value, match=NUMERIC.search):
+    return type(value) is int or match(str(value)) is not None
+
+
+def _defined(value, name):
+    # Reads a variable which may hold None, which eval() treats as not defined !
+    if value is None:
+        raise LogicError("Variable <%s> is not yet defined" % name)
+    return value
+
+
+def _undefined_function(name):
+    raise LogicError("Function <%s> is not yet defined" % name)
+
+
+def _not(value):
+    if isinstance(value, bool):
+        return not value
+    raise LogicError("Cannot 'not' that")
+
+
+def _abs(value):
+    if _is_numeric(value):
+        return abs(value)
+    raise ValueError("Cannot abs() not numerical values !")
+
+
+def _sin(value, digits, sin=math.sin):
+    if _is_numeric(value):
+        return round(sin(value), digits)
+    raise ValueError("Cannot sin() not numerical values !")
+
+
+def _cos(value, digits, cos=math.cos):
+    if _is_numeric(value):
+        return round(cos(value), digits)
+    raise ValueError("Cannot cos() not numerical values !")
+
+
+def _tan(value, digits, tan=math.tan):
+    if _is_numeric(value):
+        return round(tan(value), digits)
+    raise ValueError("Cannot tan() not numerical values !")
+
+
+def _pow(value, value2, pow=math.pow):
+    if _is_numeric(value) and _is_numeric(value2):
+        return pow(value, value2)
+    raise ValueError("Cannot pow() not numerical values !")
+
+
+def _input(*prompt):
+    result = input(*prompt)
+    if NUMERIC.search(str(result)):
+        return float(result)
+    return str(result)
+
+
+RUNTIME = {
+    'LogicError': LogicError, 'ImmutableError': ImmutableError, '_defined': _defined,
+    '_undefined_function': _undefined_function, '_not': _not, '_abs': _abs, '_sin': _sin, '_cos': _cos, '_tan': _tan,
+    '_pow': _pow, '_input': _input,
+}
+
+OPERATORS = {
+    operator.add: ast.Add, operator.sub: ast.Sub, operator.mul: ast.Mult, operator.truediv: ast.Div,
+}
+COMPARISONS = {
+    operator.eq: ast.Eq, operator.ne: ast.NotEq, operator.gt: ast.Gt, operator.lt: ast.Lt, operator.ge: ast.GtE,
+    operator.le: ast.LtE,
+}
+
+
+def name(identifier):
+    return ast.Name(id=identifier, ctx=ast.Load())
+
+
+def call(function, *args):
+    return ast.Call(func=name(function), args=list(args), keywords=[])
+
+
+def may_be_none(node):
+    # Only a function call returns None, when its last statement doesn't return a value !
+    if isinstance(node, ExpressParenthesis):
+        return may_be_none(node.expression)
+    if isinstance(node, (And, Or)):
+        return may_be_none(node.left) or may_be_none(node.right)
+    return isinstance(node, CallFunction)
+
+
+class Transpiler:
+    """
+    Lowers the AST of a program to an ast.Module: the program becomes the function _main and each declared function
+    the function _fn_<name>, both returning the value of their last statement like eval(). The variables live in the
+    dict V, a read of an undefined one raises a KeyError which TranspiledProgram turns into the LogicError of eval().
+    """
+    def __init__(self, state):
+        self.functions = state.functions
+        self.declarations = []  # The values of the declaration statements, bound as _declarations !
+        self.nullable = set()  # The variables which may be assigned None, read through _defined !
+
+    def transpile(self, main):
+        self.find_nullable(main)
+        for declaration in self.functions.values():
+            self.find_nullable(declaration.block)
+        body = [self.function("_main", main.program.statements)]
+        for function_name, declaration in self.functions.items():
+            body.append(self.function(FUNCTION_PREFIX + function_name, declaration.block.statements))
+        return ast.fix_missing_locations(ast.Module(body=body, type_ignores=[]))
+
+    def find_nullable(self, node):
+        if isinstance(node, Assignment) and isinstance(node.left, Variable) and may_be_none(node.right):
+            self.nullable.add(node.left.get_name())
+        for child in vars(node).values():
+            for item in (child if isinstance(child, list) else [child]):
+                if isinstance(item, BaseBox) and not isinstance(item, FunctionDeclaration):
+                    self.find_nullable(item)
+
+    def function(self, function_name, statements):
+        return ast.FunctionDef(
+            name=function_name, args=ast.arguments(
+                posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
+            ), body=self.statements(statements, True), decorator_list=[], returns=None
+        )
+
+    def statements(self, statements, tail):
+        # A tail block returns the value of its last statement !
+        body = []
+        for i, statement in enumerate(statements):
+            body.extend(self.statement(statement, tail and i == len(statements) - 1))
+        return body or [ast.Pass()]
+
+    def statement(self, node, tail):
+        if isinstance(node, StatementFull):
+            return self.statement(node.statement, tail)
+        if isinstance(node, If):
+            if node.else_body is None:
+                orelse = [ast.Return(value=ast.Constant(value=None))] if tail else []
+            else:
+                orelse = self.statements(node.else_body.statements, tail)
+            return [ast.If(
+                test=self.expression(node.condition), body=self.statements(node.body.statements, tail), orelse=orelse
+            )]
+        if isinstance(node, Assignment):
+            if not isinstance(node.left, Variable):
+                raise LogicError("Cannot assign to <%s>" % node)
+            variable = node.left.get_name()
+            # Defined variables are immutable, checked before evaluating the value like eval() !
+            lookup = ast.Call(
+                func=ast.Attribute(value=name('V'), attr='get', ctx=ast.Load()),
+                args=[ast.Constant(value=variable)], keywords=[]
+            )
+            body = [
+                ast.If(
+                    test=ast.Compare(left=lookup, ops=[ast.IsNot()], comparators=[ast.Constant(value=None)]),
+                    body=[ast.Raise(exc=call('ImmutableError', ast.Constant(value=variable)), cause=None)],
+                    orelse=[]
+                ),
+                ast.Assign(
+                    targets=[ast.Subscript(value=name('V'), slice=ast.Constant(value=variable), ctx=ast.Store())],
+                    value=self.expression(node.right)
+                ),
+            ]
+            if tail:
+                body.append(ast.Return(value=name('V')))  # Like eval(), an assignment returns the variables !
+            return body
+        if isinstance(node, FunctionDeclaration):
+            if not tail:
+                return []
+            self.declarations.append(node)
+            return [ast.Return(value=ast.Subscript(
+                value=name('_declarations'), slice=ast.Constant(value=len(self.declarations) - 1), ctx=ast.Load()
+            ))]
+        if isinstance(node, Print):
+            args = [] if node.value is None else [self.expression(node.value)]
+            body = [ast.Expr(value=call('print', *args))]
+            if tail:
+                body.append(ast.Return(value=ast.Constant(value=None)))
+            return body
+        if isinstance(node, Statement):
+            node = node.expression
+        if tail:
+            return [ast.Return(value=self.expression(node))]
+        return [ast.Expr(value=self.expression(node))]
+
+    def expression(self, node):
+        if isinstance(node, (Statement, ExpressParenthesis)):
+            return self.expression(node.expression)
+        if isinstance(node, Constant):
+            return ast.Constant(value=node.value)
+        if isinstance(node, Variable):
+            value = ast.Subscript(value=name('V'), slice=ast.Constant(value=node.name), ctx=ast.Load())
+            if node.name in self.nullable:
+                value = call(
+                    '_defined', ast.Call(
+                        func=ast.Attribute(value=name('V'), attr='get', ctx=ast.Load()),
+                        args=[ast.Constant(value=node.name)], keywords=[]
+                    ), ast.Constant(value=node.name)
+                )
+            return value
+        if isinstance(node, And):
+            return ast.BoolOp(op=ast.And(), values=[self.expression(node.left), self.expression(node.right)])
+        if isinstance(node, Or):
+            return ast.BoolOp(op=ast.Or(), values=[self.expression(node.left), self.expression(node.right)])
+        if isinstance(node, BinaryOp) and node.operation in OPERATORS:
+            return ast.BinOp(
+                left=self.expression(node.left), op=OPERATORS[node.operation](), right=self.expression(node.right)
+            )
+        if isinstance(node, BinaryOp) and node.operation in COMPARISONS:
+            return ast.Compare(
+                left=self.expression(node.left), ops=[COMPARISONS[node.operation]()],
+                comparators=[self.expression(node.right)]
+            )
+        if isinstance(node, Not):
+            return call('_not', self.expression(node.value))
+        if isinstance(node, CallFunction):
+            if node.name in self.functions:
+                return call(FUNCTION_PREFIX + node.name)
+            return call('_undefined_function', ast.Constant(value=node.name))
+        if isinstance(node, Input):
+            return call('_input', *([] if node.value is None else [self.expression(node.value)]))
+        if isinstance(node, Absolute):
+            return call('_abs', self.expression(node.expression))
+        if isinstance(node, (Sin, Cos, Tan)):
+            function = {Sin: '_sin', Cos: '_cos', Tan: '_tan'}[type(node)]
+            return call(function, self.expression(node.expression), ast.Constant(value=node.roundOffDigits))
+        if isinstance(node, Pow):
+            return call('_pow', self.expression(node.expression), self.expression(node.expression2))
+        if isinstance(node, StreamedProgram):
+            raise LogicError("Cannot compile a streamed program, its statements already ran")
+        raise LogicError("Cannot transpile <%s>" % type(node).__name__)
+
+
+class TranspiledProgram:
+    """
+    A program transpiled to a Python code object, which defines its functions once in its namespace. Each run without
+    a state starts from no variables.
+    """
+    def __init__(self, main, state, filename="<transpiled>"):
+        transpiler = Transpiler(state)
+        self.module = transpiler.transpile(main)
+        self.code = compile(self.module, filename, "exec")
+        self.namespace = dict(RUNTIME)
+        self.namespace['_declarations'] = transpiler.declarations
+        exec(self.code, self.namespace)
+
+    @property
+    def source(self):
+        return ast.unparse(self.module)
+
+    def run(self, state=None):
+        if state is None:
+            state = ParserState()
+        self.namespace['V'] = state.variables
+        try:
+            return self.namespace['_main']()
+        except KeyError as e:  # Only raised by reading an undefined variable from V !
+            raise LogicError("Variable <%s> is not yet defined" % e.args[0]) from None
+
+
+def compile_program(main, state):
+    # The state is the ParserState the program was parsed with, which holds its functions !
+    return TranspiledProgram(main, state)
+
+
+def compile_source(source, lexer=None, parser=None):
+    state = ParserState()
+    lexer = lexer if lexer is not None else Lexer().build()
+    parser = parser if parser is not None else Parser().build()
+    return compile_program(parser.parse(lexer.lex(source), state=state), state)
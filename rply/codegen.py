@@ -0,0 +1,363 @@
+"""
+Writes the tables of a parser into a Python module, which builds an
+:class:`~rply.parser.LRParser` when imported without constructing the LALR
+tables or using the cache directory. As plain literals, the tables are
+stored in the module's ``.pyc`` file and load almost instantly.
+
+Generate the module once, e.g. in a build step::
+
+    from rply.codegen import write_module
+    write_module(pg, "parsetab.py")
+
+and build the parser from it later::
+
+    import parsetab
+    parser = parsetab.build(pg)
+
+It also generates the :class:`DirectLRParser`, which turns the tables into
+Python code instead of interpreting them.
+"""
+import importlib
+import py_compile
+
+from rply.errors import ParserGeneratorError
+from rply.grammar import Grammar, Production
+from rply.parser import ERROR, DenseLRParser, LRParser
+from rply.token import Token
+
+
+VERSION = 1
+
+TEMPLATE = '''\
+# Generated by rply.codegen, do not edit.
+from rply.codegen import load_parser
+
+VERSION = %(version)r
+GRAMMAR_HASH = %(grammar_hash)r
+
+# (name, symbols, precedence, callback) of each production, the callback is
+# "module:qualname" or None if it can't be imported.
+PRODUCTIONS = %(productions)s
+
+ERROR_HANDLER = %(error_handler)r
+
+# The (symbols, entries) of each state. Unlike dicts, nested tuples are
+# constants, which are loaded straight from the .pyc file.
+LR_ACTION = %(lr_action)s
+
+LR_GOTO = %(lr_goto)s
+
+DEFAULT_REDUCTIONS = %(default_reductions)r
+
+
+def build(pg=None):
+    return load_parser(globals(), pg)
+'''
+
+
+def callback_reference(func):
+    """
+    Returns a ``"module:qualname"`` reference to `func`, or `None` if it
+    can't be imported, e.g. because it's defined inside another function.
+    """
+    if func is None:
+        return None
+    qualname = getattr(func, "__qualname__", func.__name__)
+    if "<" in qualname:
+        return None
+    return "%s:%s" % (func.__module__, qualname)
+
+
+def resolve_callback(reference):
+    module_name, qualname = reference.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def generate_module(pg):
+    """
+    Returns the source of a module holding the tables of the parser built
+    by the :class:`~rply.ParserGenerator` `pg`.
+    """
+    # Only needed here, importing it would slow down loading the parser.
+    import pprint
+
+    parser = pg.build()
+    table = parser.lr_table
+    grammar = table.grammar
+    productions = tuple(
+        (p.name, tuple(p.prod), tuple(p.prec), callback_reference(p.func))
+        for p in grammar.productions
+    )
+    return TEMPLATE % {
+        "version": VERSION,
+        "grammar_hash": pg.compute_grammar_hash(grammar),
+        "productions": pprint.pformat(productions),
+        "error_handler": callback_reference(pg.error_handler),
+        "lr_action": pprint.pformat(_rows(table.lr_action)),
+        "lr_goto": pprint.pformat(_rows(table.lr_goto)),
+        "default_reductions": tuple(table.default_reductions),
+    }
+
+
+def _rows(rows):
+    return tuple(
+        (tuple(sorted(row)), tuple(row[k] for k in sorted(row)))
+        for row in rows
+    )
+
+
+def _dicts(rows):
+    return [dict(zip(keys, values)) for keys, values in rows]
+
+
+def write_module(pg, path):
+    """
+    Writes the module generated by :func:`generate_module` to `path`, and
+    compiles it, so that even the first import loads the tables from the
+    ``.pyc`` file.
+    """
+    with open(path, "w") as f:
+        f.write(generate_module(pg))
+    py_compile.compile(path, doraise=True)
+
+
+def load_parser(namespace, pg=None):
+    """
+    Returns an :class:`~rply.parser.LRParser` from the globals of a generated
+    module.
+
+    If `pg` is given, its callbacks and error handler are used, which works
+    for callbacks that can't be imported. A
+    :class:`~rply.errors.ParserGeneratorError` is raised if its grammar
+    differs from the one the module was generated from. Otherwise the
+    callbacks are imported by name.
+    """
+    # Imported here, because rply.parsergenerator imports this module.
+    from rply.parsergenerator import LRTable
+
+    if namespace["VERSION"] != VERSION:
+        raise ParserGeneratorError(
+            "Unsupported parser module version %r" % (namespace["VERSION"],)
+        )
+    if pg is not None:
+        grammar = pg.build_grammar()
+        if pg.compute_grammar_hash(grammar) != namespace["GRAMMAR_HASH"]:
+            raise ParserGeneratorError(
+                "The parser module was generated from a different grammar"
+            )
+        error_handler = pg.error_handler
+    else:
+        grammar = Grammar([])
+        grammar.productions = []
+        for number, (name, prod, prec, callback) in enumerate(
+                namespace["PRODUCTIONS"]):
+            if callback is None and number > 0:
+                raise ParserGeneratorError(
+                    "The callback of production %d (%s) can't be imported, "
+                    "pass the ParserGenerator instead" % (number, name)
+                )
+            func = resolve_callback(callback) if callback else None
+            grammar.productions.append(
+                Production(number, name, list(prod), prec, func)
+            )
+        error_handler = namespace["ERROR_HANDLER"]
+        if error_handler is not None:
+            error_handler = resolve_callback(error_handler)
+    table = LRTable(
+        grammar, _dicts(namespace["LR_ACTION"]), _dicts(namespace["LR_GOTO"]),
+        list(namespace["DEFAULT_REDUCTIONS"]), [], []
+    )
+    return LRParser(table, error_handler)
+
+
+class DirectLRParser(DenseLRParser):
+    """
+    A directly coded parser: the tables are turned into the source of a
+    parse function, in which every state is a nested function returning the
+    next state, dispatched through a list indexed by state. A state looks up
+    its action for the lookahead in its own row of the action table, then
+    shifts, or runs the inlined reduction and goto. Reductions always
+    followed by a default reduction run it as well, without dispatching.
+    The generated source is available as `source`.
+
+    `terminal_counts` maps terminal names to how often they occur, e.g. in a
+    sample of the tokens to parse, so the actions of the most frequent ones
+    are tested first. Without it, the actions of the most terminals come
+    first.
+    """
+    def __init__(self, lr_table, error_handler, terminal_counts=None):
+        DenseLRParser.__init__(self, lr_table, error_handler)
+        namespace = {"Token": Token, "_error": self._error}
+        self.source = generate_parser_source(
+            self, namespace, terminal_counts
+        )
+        exec(compile(self.source, "<rply direct parser>", "exec"), namespace)
+        self._parse = namespace["parse"]
+
+    def parse(self, tokenizer, state=None, log=None):
+        if log is not None:
+            # The generated code doesn't record a log.
+            return DenseLRParser.parse(self, tokenizer, state, log)
+        return self._parse(tokenizer, state)
+
+
+def generate_parser_source(parser, namespace, terminal_counts=None):
+    """
+    Returns the source of a parse function equivalent to the
+    :class:`~rply.parser.DenseLRParser` `parser`. The constants it refers to
+    are added to `namespace`.
+    """
+    namespace["terminal_ids"] = parser.terminal_ids
+    namespace["goto"] = parser.goto
+    for number, func in enumerate(parser.funcs):
+        namespace["f%d" % number] = func
+    counts = [0] * len(parser.terminals)
+    for name, count in (terminal_counts or {}).items():
+        if name in parser.terminal_ids:
+            counts[parser.terminal_ids[name]] = count
+
+    lines = []
+    # The callbacks are called with or without the state, deciding that
+    # once per parse instead of once per reduction.
+    _emit_parse(
+        parser, namespace, lines, "parse_stateless", "f%d(targ)", counts
+    )
+    _emit_parse(
+        parser, namespace, lines, "parse_stateful", "f%d(state, targ)", counts
+    )
+    lines.extend([
+        "def parse(tokenizer, state=None):",
+        "    if state is None:",
+        "        return parse_stateless(tokenizer, state)",
+        "    return parse_stateful(tokenizer, state)",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def _emit_parse(parser, namespace, lines, name, call, counts):
+    nstates = len(parser.default_reductions)
+    lines.extend([
+        "def %s(tokenizer, state):" % name,
+        "    tokenizer = iter(tokenizer)",
+        "    lookahead = None",
+        "    ltype = -1",
+        "    result = None",
+        "    statestack = [0]",
+        "    symstack = [Token('$end', '$end')]",
+        "    push_state = statestack.append",
+        "    push_symbol = symstack.append",
+    ])
+    for st in range(nstates):
+        _emit_state(parser, namespace, lines, st, call, counts)
+    lines.extend([
+        "    states = [%s]" % ", ".join("s%d" % st for st in range(nstates)),
+        # No shift or goto leads back to the start state, so 0 means done.
+        "    current_state = s0()",
+        "    while current_state:",
+        "        current_state = states[current_state]()",
+        "    return result",
+        "",
+    ])
+
+
+def _emit_state(parser, namespace, lines, st, call, counts):
+    lines.append("    def s%d():" % st)
+    indent = "        "
+    if parser.default_reductions[st]:
+        _emit_reduce(parser, lines, -parser.default_reductions[st], 2, call)
+        return
+    # The actions of the state by terminal, the last entry standing for
+    # the unknown terminal -1. Shifts are positive and reductions negative,
+    # errors are the reduction of a production that doesn't exist.
+    width = len(parser.terminals)
+    error = -len(parser.lengths)
+    row = [
+        error if t == ERROR else t
+        for t in parser.action[st * width:(st + 1) * width]
+    ] + [error]
+    name = "a%d" % st
+    namespace[name] = row
+    branches = {}
+    for terminal, t in enumerate(row[:width]):
+        if t != error:
+            branches.setdefault(max(t, 1) if t > 0 else t, []).append(terminal)
+    lines.extend(indent + line for line in [
+        "nonlocal lookahead, ltype%s" % (", result" if 0 in branches else ""),
+        "if lookahead is None:",
+        "    lookahead = next(tokenizer, None)",
+        "    if lookahead is None:",
+        "        lookahead = Token('$end', '$end')",
+        "    ltype = terminal_ids.get(lookahead.gettokentype(), -1)",
+        "t = %s[ltype]" % name,
+    ])
+    for t, terminals in sorted(branches.items(), key=lambda a: (
+        -sum(counts[terminal] for terminal in a[1]), -len(a[1])
+    )):
+        if t > 0:
+            # All shifts share one branch, which pushes the next state.
+            lines.extend(indent + line for line in [
+                "if t > 0:",
+                "    push_state(t)",
+                "    push_symbol(lookahead)",
+                "    lookahead = None",
+                "    return t",
+            ])
+        elif t < 0:
+            lines.append("%sif t == %d:" % (indent, t))
+            _emit_reduce(parser, lines, -t, 3, call)
+        else:
+            lines.extend(indent + line for line in [
+                "if t == 0:",
+                "    result = symstack[-1]",
+                "    return 0",
+            ])
+    lines.append("%s_error(lookahead, state)" % indent)
+
+
+def _emit_reduce(parser, lines, number, depth, call, chain=8):
+    # The stack tops are replaced in place by the reduced symbol and state.
+    indent = "    " * depth
+    length = parser.lengths[number]
+    lhs = parser.lhs[number]
+    width = len(parser.nonterminals)
+    targets = set(
+        parser.goto[st * width + lhs]
+        for st in range(len(parser.default_reductions))
+    )
+    targets.discard(-1)
+    static = len(targets) == 1
+    if static:
+        target = targets.pop()
+    else:
+        goto = "goto[statestack[-%d] * %d + %d]" % (length + 1, width, lhs)
+        lines.append("%scurrent_state = %s" % (indent, goto))
+        target = "current_state"
+    if length:
+        lines.append("%starg = symstack[-%d:]" % (indent, length))
+        if length > 1:
+            lines.extend(indent + line for line in [
+                "del symstack[-%d:]" % (length - 1),
+                "del statestack[-%d:]" % (length - 1),
+            ])
+        lines.extend(indent + line for line in [
+            "symstack[-1] = %s" % (call % number),
+            "statestack[-1] = %s" % target,
+        ])
+    else:
+        lines.extend(indent + line for line in [
+            "targ = []",
+            "push_symbol(%s)" % (call % number),
+            "push_state(%s)" % target,
+        ])
+    if static and parser.default_reductions[target] and chain:
+        # The next state reduces regardless of the lookahead, do it here.
+        lines.append("%s# State %d" % (indent, target))
+        _emit_reduce(
+            parser, lines, -parser.default_reductions[target], depth, call,
+            chain - 1
+        )
+    else:
+        lines.append("%sreturn %s" % (indent, target))
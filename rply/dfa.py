@@ -0,0 +1,523 @@
+import marshal
+import re
+import sys
+from array import array
+from bisect import bisect_right
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+from rply.errors import LexerGeneratorError
+
+
+MAXCHAR = sys.maxunicode
+
+CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r"\d",
+    sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+    sre_constants.CATEGORY_SPACE: r"\s",
+    sre_constants.CATEGORY_NOT_SPACE: r"\S",
+    sre_constants.CATEGORY_WORD: r"\w",
+    sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+APPROXIMATED = tuple(
+    getattr(sre_constants, op)
+    for op in ["ASSERT", "ASSERT_NOT", "AT", "ATOMIC_GROUP", "POSSESSIVE_REPEAT"]
+    if hasattr(sre_constants, op)
+)
+
+_category_cache = {}
+_all_chars = None
+
+
+def category_intervals(category, flags):
+    """
+    Returns the characters matched by a category such as ``\\w`` as a sorted
+    list of inclusive ``(lo, hi)`` intervals.
+    """
+    global _all_chars
+    key = (category, flags & re.ASCII)
+    if key not in _category_cache:
+        if _all_chars is None:
+            _all_chars = "".join(map(chr, range(MAXCHAR + 1)))
+        pattern = re.compile(CATEGORIES[category] + "+", flags & re.ASCII)
+        _category_cache[key] = [
+            (m.start(), m.end() - 1) for m in pattern.finditer(_all_chars)
+        ]
+    return _category_cache[key]
+
+
+def normalize(intervals):
+    result = []
+    for lo, hi in sorted(intervals):
+        if result and lo <= result[-1][1] + 1:
+            if hi > result[-1][1]:
+                result[-1] = (result[-1][0], hi)
+        else:
+            result.append((lo, hi))
+    return result
+
+
+def negate(intervals):
+    result = []
+    start = 0
+    for lo, hi in intervals:
+        if lo > start:
+            result.append((start, lo - 1))
+        start = hi + 1
+    if start <= MAXCHAR:
+        result.append((start, MAXCHAR))
+    return result
+
+
+class NFA(object):
+    """
+    A Thompson NFA over sets of characters. Transitions are stored per state
+    as lists of ``(intervals, target)`` pairs, epsilon transitions as lists of
+    targets. A guard is an epsilon transition which may only be taken if the
+    next character is not in a given set, it's used to implement a trailing
+    negative lookahead such as ``if(?!\\w)``.
+
+    If `approximate` is true, assertions such as lookaheads and anchors are
+    ignored and atomic groups or possessive repeats are treated like regular
+    ones, so that the NFA accepts a superset of what each rule matches.
+    """
+    def __init__(self, approximate=False):
+        self.approximate = approximate
+        self.edges = []
+        self.epsilons = []
+        self.guards = []
+        # Maps accepting states to the index of their rule.
+        self.accepting = {}
+
+    def new_state(self):
+        self.edges.append([])
+        self.epsilons.append([])
+        return len(self.edges) - 1
+
+    def add_rule(self, index, pattern, flags):
+        if flags & re.IGNORECASE:
+            raise LexerGeneratorError(
+                "IGNORECASE is not supported in a DFA lexer: %r" % pattern
+            )
+        first_guard = len(self.guards)
+        parsed = sre_parse.parse(pattern, flags)
+        start = self.new_state()
+        end = self._build(start, parsed, parsed.state.flags)
+        self.accepting[end] = index
+        for _, _, target in self.guards[first_guard:]:
+            closure = self.closure([target])
+            if end not in closure or any(self.edges[s] for s in closure):
+                raise LexerGeneratorError(
+                    "Lookahead is only supported at the end of a rule: %r"
+                    % pattern
+                )
+        return start
+
+    def closure(self, states):
+        result = set(states)
+        stack = list(states)
+        while stack:
+            state = stack.pop()
+            for target in self.epsilons[state]:
+                if target not in result:
+                    result.add(target)
+                    stack.append(target)
+        return frozenset(result)
+
+    def _build(self, state, items, flags):
+        for op, av in items:
+            state = self._build_item(state, op, av, flags)
+        return state
+
+    def _build_item(self, state, op, av, flags):
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL,
+                  sre_constants.ANY, sre_constants.IN):
+            target = self.new_state()
+            self.edges[state].append((self.charset(op, av, flags), target))
+            return target
+        elif op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, items = av
+            if add_flags & re.IGNORECASE:
+                raise LexerGeneratorError(
+                    "IGNORECASE is not supported in a DFA lexer"
+                )
+            return self._build(state, items, (flags | add_flags) & ~del_flags)
+        elif op is sre_constants.BRANCH:
+            end = self.new_state()
+            for items in av[1]:
+                start = self.new_state()
+                self.epsilons[state].append(start)
+                self.epsilons[self._build(start, items, flags)].append(end)
+            return end
+        elif op in REPEATS:
+            lo, hi, items = av
+            for _ in range(lo):
+                state = self._build(state, items, flags)
+            if hi == sre_constants.MAXREPEAT:
+                start = self.new_state()
+                end = self.new_state()
+                self.epsilons[state].append(start)
+                self.epsilons[state].append(end)
+                self.epsilons[self._build(start, items, flags)].append(start)
+                self.epsilons[start].append(end)
+                return end
+            end = self.new_state()
+            for _ in range(hi - lo):
+                self.epsilons[state].append(end)
+                state = self._build(state, items, flags)
+            self.epsilons[state].append(end)
+            return end
+        elif self.approximate and op in APPROXIMATED:
+            if op is sre_constants.ATOMIC_GROUP:
+                return self._build(state, av, flags)
+            elif op is sre_constants.POSSESSIVE_REPEAT:
+                return self._build_item(
+                    state, sre_constants.MAX_REPEAT, av, flags
+                )
+            return state
+        elif op is sre_constants.ASSERT_NOT and av[0] == 1:
+            forbidden = self.single_charset(av[1], flags)
+            target = self.new_state()
+            self.guards.append((state, forbidden, target))
+            return target
+        raise LexerGeneratorError(
+            "Unsupported regular expression construct in a DFA lexer: %s"
+            % (op,)
+        )
+
+    def single_charset(self, items, flags):
+        items = list(items)
+        while len(items) == 1 and items[0][0] is sre_constants.SUBPATTERN:
+            items = list(items[0][1][3])
+        if len(items) != 1 or items[0][0] not in (
+                sre_constants.LITERAL, sre_constants.NOT_LITERAL,
+                sre_constants.ANY, sre_constants.IN):
+            raise LexerGeneratorError(
+                "Only single character lookaheads are supported in a DFA "
+                "lexer"
+            )
+        op, av = items[0]
+        return self.charset(op, av, flags)
+
+    def charset(self, op, av, flags):
+        if op is sre_constants.LITERAL:
+            return [(av, av)]
+        elif op is sre_constants.NOT_LITERAL:
+            return negate([(av, av)])
+        elif op is sre_constants.ANY:
+            if flags & re.DOTALL:
+                return [(0, MAXCHAR)]
+            return negate([(ord("\n"), ord("\n"))])
+        intervals = []
+        negated = False
+        for item_op, item_av in av:
+            if item_op is sre_constants.NEGATE:
+                negated = True
+            elif item_op is sre_constants.LITERAL:
+                intervals.append((item_av, item_av))
+            elif item_op is sre_constants.RANGE:
+                intervals.append(item_av)
+            elif item_op is sre_constants.CATEGORY and item_av in CATEGORIES:
+                intervals.extend(category_intervals(item_av, flags))
+            else:
+                raise LexerGeneratorError(
+                    "Unsupported character set in a DFA lexer: %s" % (item_op,)
+                )
+        intervals = normalize(intervals)
+        if negated:
+            intervals = negate(intervals)
+        return intervals
+
+
+def overlapping_rules(rules):
+    """
+    Returns the set of pairs ``(i, j)``, with ``i < j``, of the rules in a
+    list of ``(name, pattern, flags)`` tuples which may both match at the same
+    position of some input. The order of the rules in such a pair decides
+    which one wins, the order of any other pair doesn't matter.
+
+    A rule matches at a position if the rest of the input starts with one of
+    its matches, so two rules overlap if the languages ``A.*`` and ``B.*`` of
+    their matches followed by anything intersect. This is computed on the
+    product of their automata. The result may contain pairs which don't
+    actually overlap, because assertions are ignored and rules which can't be
+    turned into an automaton overlap with every other rule.
+    """
+    nfa = NFA(approximate=True)
+    starts = []
+    unknown = []
+    for index, (name, pattern, flags) in enumerate(rules):
+        try:
+            starts.append(nfa.add_rule(index, pattern, flags))
+        except LexerGeneratorError:
+            unknown.append(index)
+    # Once a rule has matched, it keeps matching whatever follows.
+    for end in nfa.accepting:
+        nfa.edges[end].append(([(0, MAXCHAR)], end))
+    start = nfa.new_state()
+    nfa.epsilons[start].extend(starts)
+    _, _, _, class_sets = DFA._partition(nfa)
+
+    pairs = set()
+    for i in unknown:
+        for j in range(len(rules)):
+            if i != j:
+                pairs.add((min(i, j), max(i, j)))
+    initial = nfa.closure([start])
+    seen = set([initial])
+    worklist = [initial]
+    while worklist:
+        current = worklist.pop()
+        accepted = sorted(nfa.accepting[s] for s in current if s in nfa.accepting)
+        for a, i in enumerate(accepted):
+            for j in accepted[a + 1:]:
+                pairs.add((i, j))
+        if all(s in nfa.accepting for s in current):
+            # Only rules which already matched are left.
+            continue
+        moves = {}
+        for s in current:
+            for intervals, target in nfa.edges[s]:
+                for c in class_sets[id(intervals)]:
+                    moves.setdefault(c, set()).add(target)
+        for targets in moves.values():
+            target = nfa.closure(targets)
+            if target not in seen:
+                seen.add(target)
+                worklist.append(target)
+    return pairs
+
+
+class DFA(object):
+    """
+    A minimized deterministic finite automaton recognizing the rules of a
+    lexer, with its tables stored in compact arrays.
+
+    Characters are first mapped to one of `nclasses` character classes, any
+    two characters in the same class behave identically in every state. The
+    transition of `state` on class `c` is ``transitions[state * nclasses +
+    c]``, -1 if there is none. ``accept[state]`` is the index of the rule
+    accepted in `state` or -1. `guards` maps states to tuples of ``(rule,
+    forbidden)`` pairs: `rule` is only accepted if the next character's class
+    is not in `forbidden`. Rules are numbered by priority, lower wins.
+
+    `names` holds the token name of each rule, `None` for ignored rules.
+    """
+    VERSION = 1
+
+    def __init__(self, names, nclasses, transitions, accept, guards, ascii,
+                 bounds, classes, rules_hash=None):
+        self.names = names
+        self.nclasses = nclasses
+        self.transitions = transitions
+        self.accept = accept
+        self.guards = guards
+        self.ascii = ascii
+        self.bounds = bounds
+        self.classes = classes
+        self.rules_hash = rules_hash
+
+    @classmethod
+    def from_rules(cls, rules, rules_hash=None):
+        """
+        Builds a DFA from a list of ``(name, pattern, flags)`` tuples, the
+        first rule having the highest priority.
+        """
+        nfa = NFA()
+        starts = []
+        names = []
+        for index, (name, pattern, flags) in enumerate(rules):
+            starts.append(nfa.add_rule(index, pattern, flags))
+            names.append(name)
+        start = nfa.new_state()
+        nfa.epsilons[start].extend(starts)
+
+        bounds, classes, nclasses, class_sets = cls._partition(nfa)
+        edges = [
+            [(class_sets[id(intervals)], target) for intervals, target in e]
+            for e in nfa.edges
+        ]
+        guards = {}
+        for source, forbidden, target in nfa.guards:
+            reached = [
+                nfa.accepting[s] for s in nfa.closure([target])
+                if s in nfa.accepting
+            ]
+            guards.setdefault(source, []).append(
+                (min(reached), class_sets[id(forbidden)])
+            )
+
+        states, table, accept, state_guards = cls._determinize(
+            nfa, edges, guards, nclasses, start
+        )
+        table, accept, state_guards = cls._minimize(
+            len(states), nclasses, table, accept, state_guards
+        )
+
+        ascii = array("i", [classes[bisect_right(bounds, c) - 1] for c in range(128)])
+        return cls(
+            names, nclasses, array("i", table), array("i", accept),
+            state_guards, ascii, array("i", bounds), array("i", classes),
+            rules_hash,
+        )
+
+    @classmethod
+    def _partition(cls, nfa):
+        sets = [intervals for e in nfa.edges for intervals, _ in e]
+        sets += [forbidden for _, forbidden, _ in nfa.guards]
+        points = set([0])
+        for intervals in sets:
+            for lo, hi in intervals:
+                points.add(lo)
+                if hi < MAXCHAR:
+                    points.add(hi + 1)
+        bounds = sorted(points)
+        members = [[] for _ in bounds]
+        for i, intervals in enumerate(sets):
+            for lo, hi in intervals:
+                first = bisect_right(bounds, lo) - 1
+                last = bisect_right(bounds, hi) - 1
+                for j in range(first, last + 1):
+                    members[j].append(i)
+        signatures = {(): 0}
+        classes = []
+        for m in members:
+            classes.append(signatures.setdefault(tuple(m), len(signatures)))
+        class_sets = {}
+        for i, intervals in enumerate(sets):
+            class_sets[id(intervals)] = frozenset(
+                c for c, m in zip(classes, members) if i in m
+            )
+        return bounds, classes, len(signatures), class_sets
+
+    @classmethod
+    def _determinize(cls, nfa, edges, guards, nclasses, start):
+        initial = nfa.closure([start])
+        states = {initial: 0}
+        worklist = [initial]
+        table = []
+        accept = []
+        state_guards = {}
+        i = 0
+        while i < len(worklist):
+            current = worklist[i]
+            i += 1
+            row = [-1] * nclasses
+            moves = {}
+            for s in current:
+                for class_set, target in edges[s]:
+                    for c in class_set:
+                        moves.setdefault(c, set()).add(target)
+            for c, targets in moves.items():
+                target = nfa.closure(targets)
+                if target not in states:
+                    states[target] = len(states)
+                    worklist.append(target)
+                row[c] = states[target]
+            table.extend(row)
+
+            accepted = [nfa.accepting[s] for s in current if s in nfa.accepting]
+            best = min(accepted) if accepted else -1
+            accept.append(best)
+            forbidden = {}
+            for s in current:
+                for rule, classes in guards.get(s, []):
+                    if best == -1 or rule < best:
+                        if rule in forbidden:
+                            forbidden[rule] = forbidden[rule] & classes
+                        else:
+                            forbidden[rule] = classes
+            if forbidden:
+                state_guards[len(accept) - 1] = tuple(
+                    (rule, tuple(sorted(forbidden[rule])))
+                    for rule in sorted(forbidden)
+                )
+        return states, table, accept, state_guards
+
+    @classmethod
+    def _minimize(cls, nstates, nclasses, table, accept, guards):
+        block = {}
+        for s in range(nstates):
+            key = (accept[s], guards.get(s))
+            block[s] = key
+        nblocks = 0
+        while True:
+            numbering = {}
+            for s in range(nstates):
+                numbering.setdefault(block[s], len(numbering))
+            block = dict((s, numbering[block[s]]) for s in range(nstates))
+            if len(numbering) == nblocks:
+                break
+            nblocks = len(numbering)
+            block = dict(
+                (s, (block[s], tuple(
+                    block[t] if t >= 0 else -1
+                    for t in table[s * nclasses:(s + 1) * nclasses]
+                )))
+                for s in range(nstates)
+            )
+        # Renumber, so that the start state's block comes first.
+        order = {block[0]: 0}
+        for s in range(nstates):
+            order.setdefault(block[s], len(order))
+        new_table = [-1] * (len(order) * nclasses)
+        new_accept = [-1] * len(order)
+        new_guards = {}
+        for s in range(nstates):
+            n = order[block[s]]
+            new_accept[n] = accept[s]
+            if s in guards:
+                new_guards[n] = guards[s]
+            for c in range(nclasses):
+                t = table[s * nclasses + c]
+                new_table[n * nclasses + c] = order[block[t]] if t >= 0 else -1
+        return new_table, new_accept, new_guards
+
+    def char_class(self, c):
+        """
+        Returns the character class of the code point `c`.
+        """
+        if c < 128:
+            return self.ascii[c]
+        return self.classes[bisect_right(self.bounds, c) - 1]
+
+    def dumps(self):
+        """
+        Serializes the DFA into a string of bytes, which can be turned back
+        into a DFA using :meth:`loads`.
+        """
+        return marshal.dumps((
+            self.VERSION,
+            self.rules_hash,
+            tuple(self.names),
+            self.nclasses,
+            self.transitions.tobytes(),
+            self.accept.tobytes(),
+            tuple(sorted(self.guards.items())),
+            self.ascii.tobytes(),
+            self.bounds.tobytes(),
+            self.classes.tobytes(),
+        ))
+
+    @classmethod
+    def loads(cls, data):
+        (version, rules_hash, names, nclasses, transitions, accept, guards,
+         ascii, bounds, classes) = marshal.loads(data)
+        if version != cls.VERSION:
+            raise ValueError("Unsupported DFA version %r" % (version,))
+        return cls(
+            list(names), nclasses, cls._array(transitions),
+            cls._array(accept), dict(guards), cls._array(ascii),
+            cls._array(bounds), cls._array(classes), rules_hash,
+        )
+
+    @staticmethod
+    def _array(data):
+        a = array("i")
+        a.frombytes(data)
+        return a
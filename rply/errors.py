@@ -2,6 +2,10 @@ class ParserGeneratorError(Exception):
     pass
 
 
+class LexerGeneratorError(Exception):
+    pass
+
+
 class LexingError(Exception):
     """
     Raised by a Lexer, if no rule matches.
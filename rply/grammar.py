@@ -118,14 +118,15 @@ class Grammar(object):
 
     def _first(self, beta):
         result = []
+        seen = set()
         for x in beta:
             x_produces_empty = False
             for f in self.first[x]:
                 if f == "<empty>":
                     x_produces_empty = True
-                else:
-                    if f not in result:
-                        result.append(f)
+                elif f not in seen:
+                    seen.add(f)
+                    result.append(f)
             if not x_produces_empty:
                 break
         else:
@@ -138,8 +139,11 @@ class Grammar(object):
 
         self.first["$end"] = ["$end"]
 
+        # The sets mirror the lists, for constant time membership tests.
+        seen = {}
         for n in self.nonterminals:
             self.first[n] = []
+            seen[n] = set()
 
         changed = True
         while changed:
@@ -147,16 +151,20 @@ class Grammar(object):
             for n in self.nonterminals:
                 for p in self.prod_names[n]:
                     for f in self._first(p.prod):
-                        if f not in self.first[n]:
+                        if f not in seen[n]:
+                            seen[n].add(f)
                             self.first[n].append(f)
                             changed = True
 
     def compute_follow(self):
+        seen = {}
         for k in self.nonterminals:
             self.follow[k] = []
+            seen[k] = set()
 
         start = self.start
         self.follow[start] = ["$end"]
+        seen[start].add("$end")
 
         added = True
         while added:
@@ -167,14 +175,16 @@ class Grammar(object):
                         fst = self._first(p.prod[i + 1:])
                         has_empty = False
                         for f in fst:
-                            if f != "<empty>" and f not in self.follow[B]:
+                            if f != "<empty>" and f not in seen[B]:
+                                seen[B].add(f)
                                 self.follow[B].append(f)
                                 added = True
                             if f == "<empty>":
                                 has_empty = True
                         if has_empty or i == (len(p.prod) - 1):
                             for f in self.follow[p.name]:
-                                if f not in self.follow[B]:
+                                if f not in seen[B]:
+                                    seen[B].add(f)
                                     self.follow[B].append(f)
                                     added = True
 
@@ -194,7 +204,6 @@ class Production(object):
 
         self.lr_items = []
         self.lr_next = None
-        self.lr0_added = 0
         self.reduced = 0
 
     def __repr__(self):
@@ -1,44 +1,311 @@
+import json
+import re
+import time
+from array import array
+
 from rply.errors import LexingError
-from rply.token import SourcePosition, Token
+from rply.token import (
+    LazySourcePosition, LazyToken, LineIndex, SourcePosition, Token
+)
 
 
 class Lexer(object):
-    def __init__(self, rules, ignore_rules):
+    def __init__(self, rules, ignore_rules, keywords=None):
         self.rules = rules
         self.ignore_rules = ignore_rules
+        self.keywords = keywords if keywords is not None else {}
+        self._bytes_lexer = None
+
+    def lex(self, s, buffered=False, encoding="utf-8"):
+        """
+        Returns an iterator yielding the tokens in `s`. If `buffered` is true,
+        all tokens are lexed at once into a :class:`TokenBuffer`, which can
+        be iterated any number of times.
+
+        `s` may also be a bytes-like object, such as :class:`bytes`,
+        :class:`memoryview` or :class:`mmap.mmap`, which is lexed without
+        decoding or copying it. The rules are then matched against the raw
+        bytes, so they should only rely on ASCII characters. The resulting
+        tokens refer to their span of `s` and decode their value using
+        `encoding` only when it's accessed. Their positions' `idx` is a byte
+        offset into `s`, while `colno` counts the decoded characters.
+        """
+        if isinstance(s, str):
+            stream = self._stream(s)
+        else:
+            if self._bytes_lexer is None:
+                self._bytes_lexer = self._to_bytes()
+            stream = self._bytes_lexer._stream(s)
+            stream.encoding = encoding
+            stream.lines.encoding = encoding
+        if buffered:
+            return TokenBuffer.from_stream(stream)
+        return stream
+
+    def lex_types(self, s):
+        """
+        Returns an iterator yielding only the type of each token in `s`,
+        without creating the tokens.
+        """
+        next_span = self.lex(s).next_span
+        while True:
+            try:
+                name, _, _ = next_span()
+            except StopIteration:
+                return
+            yield name
 
-    def lex(self, s):
+    def lex_type_ids(self, s, terminal_ids):
+        """
+        Returns an array of the ids of the types of the tokens in `s`, as
+        numbered by `terminal_ids`, e.g. of a
+        :class:`~rply.parser.DenseLRParser`, or -1 for a type it doesn't
+        contain, and the index in `s` of the first character no rule
+        matches, or `None`. The array holds the tokens before it.
+        """
+        ids = array("i")
+        try:
+            for name in self.lex_types(s):
+                ids.append(terminal_ids.get(name, -1))
+        except LexingError as e:
+            return ids, e.getsourcepos().idx
+        return ids, None
+
+    def _stream(self, s):
         return LexerStream(self, s)
 
+    def _to_bytes(self):
+        return Lexer(
+            [rule.to_bytes() for rule in self.rules],
+            [rule.to_bytes() for rule in self.ignore_rules],
+            self._bytes_keywords(),
+        )
+
+    def _bytes_keywords(self):
+        return dict(
+            (name, dict(
+                (keyword.encode("utf-8"), keyword_name)
+                for keyword, keyword_name in keywords.items()
+            ))
+            for name, keywords in self.keywords.items()
+        )
+
+
+class CombinedLexer(Lexer):
+    """
+    A lexer which matches all ignore and token rules at once, using a single
+    regular expression with one named group per rule. `groups` maps the index
+    of each of these groups to the name of the rule, or to `None` for ignore
+    rules. The optional `scanner` matches the ignored text and a token at
+    once, for :meth:`lex_type_ids`.
+    """
+    def __init__(self, rules, ignore_rules, master, groups, keywords=None,
+                 scanner=None):
+        Lexer.__init__(self, rules, ignore_rules, keywords)
+        self.master = master
+        self.groups = groups
+        self.scanner = scanner
+
+    def _stream(self, s):
+        return CombinedLexerStream(self, s)
+
+    def lex_types(self, s):
+        if not isinstance(s, str):
+            return Lexer.lex_types(self, s)
+        return self._lex_types(s)
+
+    def _lex_types(self, s):
+        # Scanning with finditer leaves the loop over the source to the
+        # regular expression engine, a gap between two matches is an error.
+        groups = self.groups
+        keywords = self.keywords
+        pos = 0
+        for m in self.master.finditer(s):
+            if m.start() != pos:
+                break
+            pos = m.end()
+            name = groups[m.lastindex]
+            if name is not None:
+                if name in keywords:
+                    name = keywords[name].get(m.group(), name)
+                yield name
+        if pos != len(s):
+            raise LexingError(None, LazySourcePosition(pos, LineIndex(s)))
+
+    def lex_type_ids(self, s, terminal_ids):
+        if self.scanner is None or not isinstance(s, str):
+            return Lexer.lex_type_ids(self, s, terminal_ids)
+        scanner = self.scanner
+        # The id of the token type matched by each group of the scanner, and
+        # the ids of the keywords of a rule with keywords.
+        types = [-1] * (scanner.groups + 1)
+        keywords = {}
+        names = dict((i, group) for group, i in self.master.groupindex.items())
+        for i, name in self.groups.items():
+            if name is None:
+                continue
+            index = scanner.groupindex[names[i]]
+            types[index] = terminal_ids.get(name, -1)
+            if name in self.keywords:
+                keywords[index] = dict(
+                    (keyword, terminal_ids.get(kind, -1))
+                    for keyword, kind in self.keywords[name].items()
+                )
+        end = scanner.groupindex["_end"]
+        error = scanner.groupindex["_error"]
+        ids = array("i")
+        append = ids.append
+        for m in scanner.finditer(s):
+            i = m.lastindex
+            if i in keywords:
+                append(keywords[i].get(m.group(i), types[i]))
+            elif i == end:
+                break
+            elif i == error:
+                return ids, m.start(i)
+            else:
+                append(types[i])
+        return ids, None
+
+    def _to_bytes(self):
+        master = re.compile(
+            self.master.pattern.encode("utf-8"),
+            self.master.flags & ~re.UNICODE
+        )
+        return CombinedLexer(
+            self.rules, self.ignore_rules, master, self.groups,
+            self._bytes_keywords()
+        )
+
+
+class DFALexer(Lexer):
+    """
+    A lexer driven by a :class:`~rply.dfa.DFA`, which scans the source in a
+    single pass and resolves ambiguities by preferring the longest match and
+    then the rule added first.
+    """
+    def __init__(self, rules, ignore_rules, dfa, keywords=None):
+        Lexer.__init__(self, rules, ignore_rules, keywords)
+        self.dfa = dfa
+
+    def _stream(self, s):
+        return DFALexerStream(self, s)
+
+    def _to_bytes(self):
+        raise TypeError("A DFA lexer can only lex strings")
+
+
+class ProfilingLexer(Lexer):
+    """
+    A lexer which records in a :class:`LexerProfile` how often each rule is
+    attempted and matches, and how much time matching it takes. The same
+    profile accumulates over all sources lexed.
+    """
+    def __init__(self, rules, ignore_rules, keywords=None):
+        Lexer.__init__(self, rules, ignore_rules, keywords)
+        self.profile = LexerProfile(
+            [None] * len(ignore_rules) + [rule.name for rule in rules]
+        )
+
+    def _stream(self, s):
+        return ProfilingLexerStream(self, s)
+
+    def _to_bytes(self):
+        lexer = ProfilingLexer(
+            [rule.to_bytes() for rule in self.rules],
+            [rule.to_bytes() for rule in self.ignore_rules],
+            self._bytes_keywords(),
+        )
+        lexer.profile = self.profile
+        return lexer
+
+
+class LexerProfile(object):
+    """
+    The statistics collected by a :class:`ProfilingLexer`. `names` holds the
+    name of each rule, `None` for ignored rules, which come first. The
+    ``attempts``, ``matches`` and ``seconds`` lists are indexed like `names`.
+    """
+    def __init__(self, names):
+        self.names = names
+        self.attempts = [0] * len(names)
+        self.matches = [0] * len(names)
+        self.seconds = [0.0] * len(names)
+
+    def matches_by_name(self):
+        """
+        Returns a dict mapping the name of each token rule to the number of
+        tokens it matched.
+        """
+        counts = {}
+        for name, matches in zip(self.names, self.matches):
+            if name is not None:
+                counts[name] = counts.get(name, 0) + matches
+        return counts
+
+    def report(self):
+        """
+        Returns a table of the statistics of every rule, slowest first.
+        """
+        lines = ["%-20s %10s %10s %10s" % ("rule", "attempts", "matches", "ms")]
+        order = sorted(
+            range(len(self.names)), key=lambda i: -self.seconds[i]
+        )
+        for i in order:
+            name = self.names[i]
+            lines.append("%-20s %10d %10d %10.3f" % (
+                "(ignored)" if name is None else name, self.attempts[i],
+                self.matches[i], self.seconds[i] * 1000
+            ))
+        return "\n".join(lines)
+
+    def dumps(self):
+        """
+        Serializes the profile into a JSON string, which can be turned back
+        into a profile using :meth:`loads`.
+        """
+        return json.dumps({
+            "names": self.names,
+            "attempts": self.attempts,
+            "matches": self.matches,
+            "seconds": self.seconds,
+        })
+
+    @classmethod
+    def loads(cls, data):
+        data = json.loads(data)
+        profile = cls(data["names"])
+        profile.attempts = data["attempts"]
+        profile.matches = data["matches"]
+        profile.seconds = data["seconds"]
+        return profile
+
 
 class LexerStream(object):
     def __init__(self, lexer, s):
         self.lexer = lexer
         self.s = s
         self.idx = 0
+        self.encoding = None
+        self.keywords = lexer.keywords
 
-        self._lineno = 1
+        self.lines = LineIndex(s)
 
     def __iter__(self):
         return self
 
-    def _update_pos(self, match):
-        self.idx = match.end
-        self._lineno += self.s.count("\n", match.start, match.end)
-        last_nl = self.s.rfind("\n", 0, match.start)
-        if last_nl < 0:
-            return match.start + 1
-        else:
-            return match.start - last_nl
-
-    def next(self):
+    def next_span(self):
+        """
+        Returns the name, start and end index of the next token, without
+        creating a :class:`~rply.Token`.
+        """
         while True:
             if self.idx >= len(self.s):
                 raise StopIteration
             for rule in self.lexer.ignore_rules:
                 match = rule.matches(self.s, self.idx)
                 if match:
-                    self._update_pos(match)
+                    self.idx = match.end
                     break
             else:
                 break
@@ -46,15 +313,230 @@ class LexerStream(object):
         for rule in self.lexer.rules:
             match = rule.matches(self.s, self.idx)
             if match:
-                lineno = self._lineno
-                colno = self._update_pos(match)
-                source_pos = SourcePosition(match.start, lineno, colno)
-                token = Token(
-                    rule.name, self.s[match.start:match.end], source_pos
-                )
-                return token
+                self.idx = match.end
+                name = rule.name
+                if name in self.keywords:
+                    name = self._keyword(name, match.start, match.end)
+                return name, match.start, match.end
         else:
-            raise LexingError(None, SourcePosition(self.idx, -1, -1))
+            raise LexingError(None, LazySourcePosition(self.idx, self.lines))
+
+    def _keyword(self, name, start, end):
+        value = self.s[start:end]
+        if self.encoding is not None:
+            # Slices of a memoryview are not hashable.
+            value = bytes(value)
+        return self.keywords[name].get(value, name)
+
+    def next(self):
+        name, start, end = self.next_span()
+        source_pos = LazySourcePosition(start, self.lines)
+        if self.encoding is None:
+            return Token(name, self.s[start:end], source_pos)
+        return LazyToken(name, self.s, start, end, source_pos, self.encoding)
 
     def __next__(self):
         return self.next()
+
+
+class ProfilingLexerStream(LexerStream):
+    def next_span(self):
+        profile = self.lexer.profile
+        attempts = profile.attempts
+        matches = profile.matches
+        seconds = profile.seconds
+        clock = time.perf_counter
+        while True:
+            if self.idx >= len(self.s):
+                raise StopIteration
+            for i, rule in enumerate(self.lexer.ignore_rules):
+                started = clock()
+                match = rule.matches(self.s, self.idx)
+                seconds[i] += clock() - started
+                attempts[i] += 1
+                if match:
+                    matches[i] += 1
+                    self.idx = match.end
+                    break
+            else:
+                break
+
+        offset = len(self.lexer.ignore_rules)
+        for i, rule in enumerate(self.lexer.rules, offset):
+            started = clock()
+            match = rule.matches(self.s, self.idx)
+            seconds[i] += clock() - started
+            attempts[i] += 1
+            if match:
+                matches[i] += 1
+                self.idx = match.end
+                name = rule.name
+                if name in self.keywords:
+                    name = self._keyword(name, match.start, match.end)
+                return name, match.start, match.end
+        else:
+            raise LexingError(None, LazySourcePosition(self.idx, self.lines))
+
+
+class CombinedLexerStream(LexerStream):
+    def next_span(self):
+        while True:
+            if self.idx >= len(self.s):
+                raise StopIteration
+            m = self.lexer.master.match(self.s, self.idx)
+            if m is None:
+                raise LexingError(
+                    None, LazySourcePosition(self.idx, self.lines)
+                )
+            start, self.idx = m.span()
+            name = self.lexer.groups[m.lastindex]
+            if name is not None:
+                if name in self.keywords:
+                    name = self._keyword(name, start, self.idx)
+                return name, start, self.idx
+
+
+class DFALexerStream(LexerStream):
+    def next_span(self):
+        dfa = self.lexer.dfa
+        transitions = dfa.transitions
+        accept = dfa.accept
+        guards = dfa.guards
+        nclasses = dfa.nclasses
+        s = self.s
+        end = len(s)
+        while True:
+            if self.idx >= end:
+                raise StopIteration
+            start = pos = self.idx
+            state = 0
+            rule = -1
+            rule_end = start
+            while True:
+                accepted = accept[state]
+                if state in guards:
+                    cls = dfa.char_class(ord(s[pos])) if pos < end else -1
+                    for guarded, forbidden in guards[state]:
+                        if accepted >= 0 and guarded > accepted:
+                            break
+                        if cls not in forbidden:
+                            accepted = guarded
+                            break
+                if accepted >= 0:
+                    rule = accepted
+                    rule_end = pos
+                if pos >= end:
+                    break
+                state = transitions[
+                    state * nclasses + dfa.char_class(ord(s[pos]))
+                ]
+                if state < 0:
+                    break
+                pos += 1
+            if rule_end == start:
+                raise LexingError(None, LazySourcePosition(start, self.lines))
+            self.idx = rule_end
+            name = dfa.names[rule]
+            if name is not None:
+                if name in self.keywords:
+                    name = self._keyword(name, start, rule_end)
+                return name, start, rule_end
+
+
+class TokenBuffer(object):
+    """
+    A materialized sequence of tokens, which can be iterated any number of
+    times and passed to a parser like any other token iterator.
+
+    Tokens are stored column-wise, in parallel arrays of type ids (indices
+    into `names`), start and end indices, and line numbers. The
+    :class:`~rply.Token` instances are only created when accessed.
+    """
+    def __init__(self, s, lines=None, encoding=None):
+        self.s = s
+        self.lines = lines if lines is not None else LineIndex(s)
+        self.encoding = encoding
+        self.names = []
+        self.type_ids = {}
+        self.types = array("i")
+        self.starts = array("i")
+        self.ends = array("i")
+        self.linenos = array("i")
+
+    @classmethod
+    def from_stream(cls, stream):
+        """
+        Lexes all remaining tokens of a :class:`LexerStream`.
+        """
+        buf = cls(stream.s, stream.lines, stream.encoding)
+        line_starts = stream.lines.get_starts()
+        type_ids = buf.type_ids
+        types = buf.types
+        starts = buf.starts
+        ends = buf.ends
+        linenos = buf.linenos
+        lineno = 1
+        nlines = len(line_starts)
+        while True:
+            try:
+                name, start, end = stream.next_span()
+            except StopIteration:
+                break
+            try:
+                type_id = type_ids[name]
+            except KeyError:
+                type_id = buf.add_name(name)
+            while lineno < nlines and line_starts[lineno] <= start:
+                lineno += 1
+            types.append(type_id)
+            starts.append(start)
+            ends.append(end)
+            linenos.append(lineno)
+        return buf
+
+    def add_name(self, name):
+        """
+        Returns the type id of the token name `name`, assigning a new one if
+        necessary.
+        """
+        if name not in self.type_ids:
+            self.type_ids[name] = len(self.names)
+            self.names.append(name)
+        return self.type_ids[name]
+
+    def append(self, name, start, end, lineno):
+        self.types.append(self.add_name(name))
+        self.starts.append(start)
+        self.ends.append(end)
+        self.linenos.append(lineno)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.types)
+        start = self.starts[i]
+        lineno = self.linenos[i]
+        source_pos = SourcePosition(
+            start, lineno, self.lines.column(start, lineno)
+        )
+        if self.encoding is None:
+            return Token(
+                self.names[self.types[i]], self.s[start:self.ends[i]],
+                source_pos
+            )
+        return LazyToken(
+            self.names[self.types[i]], self.s, start, self.ends[i],
+            source_pos, self.encoding
+        )
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self[i]
+
+    def gettokentype(self, i):
+        """
+        Returns the type of the `i`-th token, without creating it.
+        """
+        return self.names[self.types[i]]
@@ -1,4 +1,9 @@
+import errno
+import hashlib
+import json
+import os
 import re
+import tempfile
 
 try:
     import rpython
@@ -11,7 +16,22 @@ except ImportError:
     def we_are_translated():
         return False
 
-from rply.lexer import Lexer
+from appdirs import AppDirs
+
+from rply.dfa import DFA, overlapping_rules
+from rply.lexer import CombinedLexer, DFALexer, Lexer, ProfilingLexer
+
+
+# Flags which can be scoped to a single group, e.g. ``(?s:...)``, and may
+# therefore differ between the rules of a combined lexer.
+SCOPED_FLAGS = [
+    (re.ASCII, "a"),
+    (re.IGNORECASE, "i"),
+    (re.MULTILINE, "m"),
+    (re.DOTALL, "s"),
+    (re.VERBOSE, "x"),
+]
+NUMBERED_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?\(\d")
 
 
 class Rule(object):
@@ -27,6 +47,16 @@ class Rule(object):
     def _freeze_(self):
         return True
 
+    def to_bytes(self):
+        """
+        Returns an equivalent rule, which matches bytes-like objects instead
+        of strings.
+        """
+        return Rule(
+            self.name, self.re.pattern.encode("utf-8"),
+            flags=self.re.flags & ~re.UNICODE
+        )
+
     def matches(self, s, pos):
         if not we_are_translated():
             m = self.re.match(s, pos)
@@ -63,6 +93,12 @@ class LexerGenerator(object):
     >>> lg.add('ADD', r'\+')
     >>> lg.ignore(r'\s+')
 
+    Keywords are best declared for the rule matching identifiers, which turns
+    them into a single dict lookup instead of one rule per keyword:
+
+    >>> lg.add('NAME', r'[a-z]+')
+    >>> lg.add_keywords('NAME', {'if': 'IF', 'else': 'ELSE'})
+
     The rules are passed to :func:`re.compile`. If you need additional flags,
     e.g. :const:`re.DOTALL`, you can pass them to :meth:`add` and
     :meth:`ignore` as an additional optional parameter:
@@ -90,6 +126,7 @@ class LexerGenerator(object):
     def __init__(self):
         self.rules = []
         self.ignore_rules = []
+        self.keywords = {}
 
     def add(self, name, pattern, flags=0):
         """
@@ -98,6 +135,16 @@ class LexerGenerator(object):
         """
         self.rules.append(Rule(name, pattern, flags=flags))
 
+    def add_keywords(self, name, keywords):
+        """
+        Adds `keywords`, a dict mapping strings to token names, to the rule
+        with the given `name`. A token matched by that rule whose value is one
+        of the keywords gets the keyword's token name instead. Unlike a rule
+        per keyword, this never matches a prefix of a longer token, such as
+        ``if`` in ``iffy``.
+        """
+        self.keywords.setdefault(name, {}).update(keywords)
+
     def ignore(self, pattern, flags=0):
         """
         Adds a rule whose matched value will be ignored. Ignored rules will be
@@ -105,10 +152,174 @@ class LexerGenerator(object):
         """
         self.ignore_rules.append(Rule("", pattern, flags=flags))
 
-    def build(self):
+    def build(self, combined=False, instrument=False, profile=None):
         """
         Returns a lexer instance, which provides a `lex` method that must be
         called with a string and returns an iterator yielding
         :class:`~rply.Token` instances.
+
+        If `combined` is true, all rules are compiled into a single regular
+        expression, so that lexing a token costs one match instead of one
+        match per rule. The rules keep their order, so the first rule added
+        still wins. If the rules cannot be combined, e.g. because they use
+        numbered backreferences or global flags, the regular lexer is
+        returned instead.
+
+        If `instrument` is true, a :class:`~rply.lexer.ProfilingLexer` is
+        returned, which tries one rule at a time and records statistics about
+        each of them in its `profile` attribute.
+
+        A recorded `profile` is used to try the rules matching the most
+        tokens first. Only rules which can never match at the same position
+        are reordered, see :func:`~rply.dfa.overlapping_rules`, so the
+        lexer's output is the same as with the original order.
         """
-        return Lexer(self.rules, self.ignore_rules)
+        rules = self.rules
+        if profile is not None:
+            rules = self._ordered_rules(profile)
+        if instrument:
+            return ProfilingLexer(rules, self.ignore_rules, self.keywords)
+        if combined:
+            lexer = self._build_combined(rules)
+            if lexer is not None:
+                return lexer
+        return Lexer(rules, self.ignore_rules, self.keywords)
+
+    def _ordered_rules(self, profile):
+        overlaps = overlapping_rules([
+            (rule.name, rule.re.pattern, rule.re.flags) for rule in self.rules
+        ])
+        counts = profile.matches_by_name()
+        # A rule is worth as much as the most frequent rule it must precede.
+        weights = [counts.get(rule.name, 0) for rule in self.rules]
+        for i, j in sorted(overlaps, reverse=True):
+            weights[i] = max(weights[i], weights[j])
+        # Among the rules whose overlapping predecessors have all been
+        # placed, pick the most valuable one.
+        remaining = set(range(len(self.rules)))
+        order = []
+        while remaining:
+            ready = [
+                j for j in remaining
+                if not any((i, j) in overlaps for i in remaining if i < j)
+            ]
+            best = max(
+                ready,
+                key=lambda j: (weights[j], counts.get(self.rules[j].name, 0), -j)
+            )
+            order.append(best)
+            remaining.remove(best)
+        return [self.rules[i] for i in order]
+
+    def _build_combined(self, rules):
+        parts = []
+        names = []
+        ignored = []
+        named = [(None, rule) for rule in self.ignore_rules]
+        named += [(rule.name, rule) for rule in rules]
+        for name, rule in named:
+            pattern = rule.re.pattern
+            flags = rule.re.flags & ~re.UNICODE
+            if NUMBERED_BACKREFERENCE.search(pattern):
+                return None
+            scoped = ""
+            for flag, letter in SCOPED_FLAGS:
+                if flags & flag:
+                    scoped += letter
+                    flags &= ~flag
+            if flags:
+                return None
+            if scoped:
+                if "x" in scoped:
+                    # A trailing comment must not swallow the closing
+                    # parenthesis of the group.
+                    pattern += "\n"
+                pattern = "(?%s:%s)" % (scoped, pattern)
+            parts.append("(?P<_%d>%s)" % (len(names), pattern))
+            if name is None:
+                ignored.append(pattern)
+            names.append(name)
+        try:
+            master = re.compile("|".join(parts))
+        except re.error:
+            return None
+        groups = {}
+        for i, name in enumerate(names):
+            groups[master.groupindex["_%d" % i]] = name
+        # Each match of the scanner also skips the ignored text before a
+        # token, without giving any of it back, so there are fewer matches.
+        # The end of the source or a character no rule matches end the scan.
+        skip = "(?:%s)*+" % "|".join(ignored) if ignored else ""
+        try:
+            scanner = re.compile(
+                "%s(?:%s|(?P<_end>\\Z)|(?P<_error>(?s:.)))"
+                % (skip, master.pattern)
+            )
+        except re.error:
+            # Possessive repetition needs Python 3.11.
+            scanner = None
+        return CombinedLexer(
+            rules, self.ignore_rules, master, groups, self.keywords, scanner
+        )
+
+    def build_dfa(self, cache_id=None):
+        """
+        Returns a lexer, which compiles all rules into a single minimized
+        :class:`~rply.dfa.DFA` and lexes in one linear pass, independent of
+        the number of rules. Unlike the other lexers, it prefers the longest
+        match and only uses the order of the rules to break ties.
+
+        Only regular constructs are supported, and lookaheads only at the end
+        of a rule and for a single character, e.g. ``if(?!\\w)``.
+
+        If a `cache_id` is given, the DFA is stored in the user's cache
+        directory and loaded from there the next time the same rules are
+        built.
+        """
+        rules = [
+            (None, rule.re.pattern, rule.re.flags)
+            for rule in self.ignore_rules
+        ]
+        rules += [
+            (rule.name, rule.re.pattern, rule.re.flags) for rule in self.rules
+        ]
+        rules_hash = self.compute_rules_hash(rules)
+
+        dfa = None
+        if cache_id is not None:
+            cache_dir = AppDirs("rply").user_cache_dir
+            cache_file = os.path.join(
+                cache_dir,
+                "%s-%s-%s.dfa" % (cache_id, DFA.VERSION, rules_hash)
+            )
+            if os.path.exists(cache_file):
+                with open(cache_file, "rb") as f:
+                    try:
+                        dfa = DFA.loads(f.read())
+                    except (ValueError, EOFError, TypeError):
+                        dfa = None
+                if dfa is not None and dfa.rules_hash != rules_hash:
+                    dfa = None
+        if dfa is None:
+            dfa = DFA.from_rules(rules, rules_hash)
+            if cache_id is not None:
+                self._write_cache(cache_dir, cache_file, dfa)
+        return DFALexer(self.rules, self.ignore_rules, dfa, self.keywords)
+
+    def compute_rules_hash(self, rules):
+        hasher = hashlib.sha1()
+        hasher.update(json.dumps(rules).encode())
+        return hasher.hexdigest()
+
+    def _write_cache(self, cache_dir, cache_file, dfa):
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir, mode=0o0700)
+            except OSError as e:
+                if e.errno == errno.EROFS:
+                    return
+                raise
+
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+            f.write(dfa.dumps())
+        os.rename(f.name, cache_file)
@@ -1,14 +1,78 @@
+from array import array
+
 from rply.errors import ParsingError
 
 
+# Marks an error in the action table of a DenseLRParser.
+ERROR = 2 ** 31 - 1
+
+
+class ParseLog(object):
+    """
+    A flat record of the shifts and reductions of a parse, in the order they
+    happen, which is a post-order walk of the parse tree. Pass it to
+    :meth:`LRParser.parse` to fill it.
+
+    ``events[i]`` is the number of the reduced production, or ``-k - 1`` for
+    the shift of ``tokens[k]``. ``counts[i]`` is the number of children of a
+    reduction, 0 for a shift. `grammar` is the parser's grammar, to look up
+    the productions.
+    """
+    def __init__(self):
+        self.events = array("i")
+        self.counts = array("i")
+        self.tokens = []
+        self.grammar = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def shift(self, token):
+        self.events.append(-len(self.tokens) - 1)
+        self.counts.append(0)
+        self.tokens.append(token)
+
+    def reduce(self, number, count):
+        self.events.append(number)
+        self.counts.append(count)
+
+    def build(self, leaf, branch):
+        """
+        Builds the parse tree bottom-up, calling ``leaf(token)`` for every
+        token and ``branch(production, children)`` for every reduction with
+        the results for its children, and returns the result for the root.
+        """
+        productions = self.grammar.productions
+        tokens = self.tokens
+        counts = self.counts
+        stack = []
+        for i, event in enumerate(self.events):
+            if event < 0:
+                stack.append(leaf(tokens[-event - 1]))
+            else:
+                start = len(stack) - counts[i]
+                children = stack[start:]
+                del stack[start:]
+                stack.append(branch(productions[event], children))
+        return stack[-1]
+
+
 class LRParser(object):
     def __init__(self, lr_table, error_handler):
         self.lr_table = lr_table
         self.error_handler = error_handler
 
-    def parse(self, tokenizer, state=None):
+    def parse(self, tokenizer, state=None, log=None):
+        """
+        Parses the tokens of `tokenizer` and returns the result of the
+        callback of the start production. If a :class:`ParseLog` is given as
+        `log`, the shifts and reductions are recorded in it.
+        """
         from rply.token import Token
 
+        if log is not None:
+            log.grammar = self.lr_table.grammar
+        tokenizer = iter(tokenizer)
         lookahead = None
         lookaheadstack = []
 
@@ -20,7 +84,7 @@ class LRParser(object):
             if self.lr_table.default_reductions[current_state]:
                 t = self.lr_table.default_reductions[current_state]
                 current_state = self._reduce_production(
-                    t, symstack, statestack, state
+                    t, symstack, statestack, state, log
                 )
                 continue
 
@@ -43,28 +107,76 @@ class LRParser(object):
                     statestack.append(t)
                     current_state = t
                     symstack.append(lookahead)
+                    if log is not None:
+                        log.shift(lookahead)
                     lookahead = None
                     continue
                 elif t < 0:
                     current_state = self._reduce_production(
-                        t, symstack, statestack, state
+                        t, symstack, statestack, state, log
                     )
                     continue
                 else:
                     n = symstack[-1]
                     return n
             else:
-                # TODO: actual error handling here
-                if self.error_handler is not None:
-                    if state is None:
-                        self.error_handler(lookahead)
-                    else:
-                        self.error_handler(state, lookahead)
-                    raise AssertionError("For now, error_handler must raise.")
-                else:
-                    raise ParsingError(None, lookahead.getsourcepos())
+                self._error(lookahead, state)
+
+    def recognize(self, types):
+        """
+        Checks whether the token types yielded by `types`, e.g. by
+        :meth:`~rply.lexer.Lexer.lex_types`, are accepted, running the
+        automaton without calling the callbacks or keeping any values. Returns
+        `None` if they are, otherwise the index of the first token which
+        can't be parsed, which is the number of tokens if the input ends too
+        early.
+        """
+        lr_action = self.lr_table.lr_action
+        lr_goto = self.lr_table.lr_goto
+        default_reductions = self.lr_table.default_reductions
+        productions = self.lr_table.grammar.productions
+
+        types = iter(types)
+        index = 0
+        ltype = next(types, "$end")
+        statestack = [0]
+        while True:
+            current_state = statestack[-1]
+            t = default_reductions[current_state]
+            if not t:
+                t = lr_action[current_state].get(ltype)
+                if t is None:
+                    return index
+                elif t > 0:
+                    statestack.append(t)
+                    index += 1
+                    ltype = next(types, "$end")
+                    continue
+                elif t == 0:
+                    return None
+            p = productions[-t]
+            del statestack[len(statestack) - p.getlength():]
+            statestack.append(lr_goto[statestack[-1]][p.name])
 
-    def _reduce_production(self, t, symstack, statestack, state):
+    def push(self, state=None, log=None):
+        """
+        Returns a :class:`PushParser`, which is fed the tokens one at a time
+        instead of pulling them from an iterator.
+        """
+        return PushParser(self, state, log)
+
+    def _error(self, lookahead, state):
+        # TODO: actual error handling here
+        if self.error_handler is not None:
+            if state is None:
+                self.error_handler(lookahead)
+            else:
+                self.error_handler(state, lookahead)
+            raise AssertionError("For now, error_handler must raise.")
+        else:
+            raise ParsingError(None, lookahead.getsourcepos())
+
+    def _reduce_production(self, t, symstack, statestack, state, log=None):
         # reduce a symbol on the stack and emit a production
         p = self.lr_table.grammar.productions[-t]
         pname = p.name
@@ -76,6 +188,8 @@ class LRParser(object):
         assert start >= 0
         del symstack[start:]
         del statestack[start:]
+        if log is not None:
+            log.reduce(-t, plen)
         if state is None:
             value = p.func(targ)
         else:
@@ -84,3 +198,270 @@ class LRParser(object):
         current_state = self.lr_table.lr_goto[statestack[-1]][pname]
         statestack.append(current_state)
         return current_state
+
+
+class PushParser(object):
+    """
+    Parses the tokens passed to :meth:`feed` one at a time, keeping its
+    stacks in between, and returns the result when :meth:`finish` is called.
+    Many push parsers can be interleaved on a single thread. They're created
+    using :meth:`LRParser.push`.
+    """
+    def __init__(self, parser, state=None, log=None):
+        from rply.token import Token
+
+        self.parser = parser
+        self.state = state
+        self.log = log
+        if log is not None:
+            log.grammar = parser.lr_table.grammar
+        self.statestack = [0]
+        self.symstack = [Token("$end", "$end")]
+        self.finished = False
+        self._reduce_defaults()
+
+    def feed(self, token):
+        """
+        Parses `token`, reducing as far as possible without the next token.
+        """
+        if self.finished:
+            raise ValueError("The parser has already finished")
+        self._advance(token)
+
+    def finish(self):
+        """
+        Parses the end of the input and returns the result of the callback of
+        the start production.
+        """
+        from rply.token import Token
+
+        if self.finished:
+            raise ValueError("The parser has already finished")
+        self._advance(Token("$end", "$end"))
+        return self.symstack[-1]
+
+    def _advance(self, lookahead):
+        lr_action = self.parser.lr_table.lr_action
+        ltype = lookahead.gettokentype()
+        while True:
+            actions = lr_action[self.statestack[-1]]
+            if ltype not in actions:
+                self.parser._error(lookahead, self.state)
+            t = actions[ltype]
+            if t > 0:
+                self.statestack.append(t)
+                self.symstack.append(lookahead)
+                if self.log is not None:
+                    self.log.shift(lookahead)
+                self._reduce_defaults()
+                return
+            elif t < 0:
+                self.parser._reduce_production(
+                    t, self.symstack, self.statestack, self.state, self.log
+                )
+            else:
+                self.finished = True
+                return
+
+    def _reduce_defaults(self):
+        default_reductions = self.parser.lr_table.default_reductions
+        t = default_reductions[self.statestack[-1]]
+        while t:
+            self.parser._reduce_production(
+                t, self.symstack, self.statestack, self.state, self.log
+            )
+            t = default_reductions[self.statestack[-1]]
+
+
+class DenseLRParser(LRParser):
+    """
+    An :class:`LRParser` whose terminals and nonterminals are numbered when
+    it's built. The action table is stored in a flat array indexed by ``state
+    * len(terminals) + terminal``, holding :data:`ERROR` where there is no
+    action, and the goto table likewise, so that each step of the parser
+    costs an array lookup instead of dict lookups by name.
+    """
+    def __init__(self, lr_table, error_handler):
+        LRParser.__init__(self, lr_table, error_handler)
+        terminals = set()
+        for row in lr_table.lr_action:
+            terminals.update(row)
+        nonterminals = set()
+        for row in lr_table.lr_goto:
+            nonterminals.update(row)
+        self.terminals = sorted(terminals)
+        self.nonterminals = sorted(nonterminals)
+        self.terminal_ids = dict(
+            (name, i) for i, name in enumerate(self.terminals)
+        )
+        self.nonterminal_ids = dict(
+            (name, i) for i, name in enumerate(self.nonterminals)
+        )
+
+        nstates = len(lr_table.lr_action)
+        width = len(self.terminals)
+        self.action = array("i", [ERROR]) * (nstates * width)
+        for st, row in enumerate(lr_table.lr_action):
+            for name, t in row.items():
+                self.action[st * width + self.terminal_ids[name]] = t
+        width = len(self.nonterminals)
+        self.goto = array("i", [-1]) * (nstates * width)
+        for st, row in enumerate(lr_table.lr_goto):
+            for name, t in row.items():
+                self.goto[st * width + self.nonterminal_ids[name]] = t
+        self.default_reductions = array("i", lr_table.default_reductions)
+
+        productions = lr_table.grammar.productions
+        self.lengths = array("i", [p.getlength() for p in productions])
+        # The start production is never reduced, it has no goto entries.
+        self.lhs = array("i", [
+            self.nonterminal_ids.get(p.name, -1) for p in productions
+        ])
+        self.funcs = [p.func for p in productions]
+
+    def recognize(self, types):
+        action = self.action
+        goto = self.goto
+        default_reductions = self.default_reductions
+        lengths = self.lengths
+        lhs = self.lhs
+        terminal_ids = self.terminal_ids
+        nterminals = len(self.terminals)
+        nnonterminals = len(self.nonterminals)
+
+        types = iter(types)
+        index = 0
+        ltype = terminal_ids.get(next(types, "$end"), -1)
+        statestack = [0]
+        push_state = statestack.append
+        current_state = 0
+        while True:
+            t = default_reductions[current_state]
+            if not t:
+                if ltype < 0:
+                    return index
+                t = action[current_state * nterminals + ltype]
+                if t > 0:
+                    if t == ERROR:
+                        return index
+                    push_state(t)
+                    current_state = t
+                    index += 1
+                    ltype = terminal_ids.get(next(types, "$end"), -1)
+                    continue
+                elif t == 0:
+                    return None
+            t = -t
+            del statestack[len(statestack) - lengths[t]:]
+            current_state = goto[statestack[-1] * nnonterminals + lhs[t]]
+            push_state(current_state)
+
+    def recognize_ids(self, ids):
+        """
+        Like :meth:`recognize`, but takes the ids of the token types in a
+        sequence, as numbered by `terminal_ids`, e.g. by
+        :meth:`~rply.lexer.Lexer.lex_type_ids`. A negative id is an error.
+        """
+        action = self.action
+        goto = self.goto
+        default_reductions = self.default_reductions
+        lengths = self.lengths
+        lhs = self.lhs
+        nterminals = len(self.terminals)
+        nnonterminals = len(self.nonterminals)
+
+        end = self.terminal_ids["$end"]
+        count = len(ids)
+        index = 0
+        ltype = ids[0] if count else end
+        statestack = [0]
+        push_state = statestack.append
+        current_state = 0
+        while True:
+            t = default_reductions[current_state]
+            if not t:
+                if ltype < 0:
+                    return index
+                t = action[current_state * nterminals + ltype]
+                if t > 0:
+                    if t == ERROR:
+                        return index
+                    push_state(t)
+                    current_state = t
+                    index += 1
+                    ltype = ids[index] if index < count else end
+                    continue
+                elif t == 0:
+                    return None
+            t = -t
+            del statestack[len(statestack) - lengths[t]:]
+            current_state = goto[statestack[-1] * nnonterminals + lhs[t]]
+            push_state(current_state)
+
+    def parse(self, tokenizer, state=None, log=None):
+        from rply.token import Token
+
+        if log is not None:
+            log.grammar = self.lr_table.grammar
+        tokenizer = iter(tokenizer)
+        action = self.action
+        goto = self.goto
+        default_reductions = self.default_reductions
+        lengths = self.lengths
+        lhs = self.lhs
+        funcs = self.funcs
+        terminal_ids = self.terminal_ids
+        nterminals = len(self.terminals)
+        nnonterminals = len(self.nonterminals)
+
+        lookahead = None
+        ltype = -1
+
+        statestack = [0]
+        symstack = [Token("$end", "$end")]
+
+        push_state = statestack.append
+        push_symbol = symstack.append
+        current_state = 0
+        while True:
+            t = default_reductions[current_state]
+            if not t:
+                if lookahead is None:
+                    try:
+                        lookahead = next(tokenizer)
+                    except StopIteration:
+                        lookahead = None
+                    if lookahead is None:
+                        lookahead = Token("$end", "$end")
+                    ltype = terminal_ids.get(lookahead.gettokentype(), -1)
+                if ltype < 0:
+                    self._error(lookahead, state)
+                t = action[current_state * nterminals + ltype]
+                if t > 0:
+                    if t == ERROR:
+                        self._error(lookahead, state)
+                    push_state(t)
+                    current_state = t
+                    push_symbol(lookahead)
+                    if log is not None:
+                        log.shift(lookahead)
+                    lookahead = None
+                    continue
+                elif t == 0:
+                    return symstack[-1]
+
+            # Reduce by production -t.
+            t = -t
+            start = len(symstack) - lengths[t]
+            targ = symstack[start:]
+            del symstack[start:]
+            del statestack[start:]
+            if log is not None:
+                log.reduce(t, lengths[t])
+            if state is None:
+                value = funcs[t](targ)
+            else:
+                value = funcs[t](state, targ)
+            push_symbol(value)
+            current_state = goto[statestack[-1] * nnonterminals + lhs[t]]
+            push_state(current_state)
@@ -1,6 +1,7 @@
 import errno
 import hashlib
 import json
+import marshal
 import os
 import sys
 import tempfile
@@ -8,10 +9,11 @@ import warnings
 
 from appdirs import AppDirs
 
+from rply.codegen import DirectLRParser
 from rply.errors import ParserGeneratorError, ParserGeneratorWarning
 from rply.grammar import Grammar
-from rply.parser import LRParser
-from rply.utils import Counter, IdentityDict, iteritems, itervalues
+from rply.parser import DenseLRParser, LRParser
+from rply.utils import iteritems, itervalues
 
 
 LARGE_VALUE = sys.maxsize
@@ -31,7 +33,7 @@ class ParserGenerator(object):
                        precedence.
     :param cache_id: A string specifying an ID for caching.
     """
-    VERSION = 1
+    VERSION = 2
 
     def __init__(self, tokens, precedence=[], cache_id=None):
         self.tokens = tokens
@@ -107,43 +109,49 @@ class ParserGenerator(object):
             hasher.update(json.dumps(p.prod).encode())
         return hasher.hexdigest()
 
-    def serialize_table(self, table):
+    def serialize_table(self, table, grammar_hash):
+        """
+        Returns the tables as nested tuples of integers, which marshal
+        compactly. Symbols are replaced by their index in ``"symbols"``.
+        """
+        symbols = sorted(table.grammar.terminals) + ["$end"]
+        symbols += sorted(table.grammar.nonterminals)
+        index = dict((sym, i) for i, sym in enumerate(symbols))
+
+        def encode(rows):
+            return tuple(
+                (tuple(index[k] for k in row), tuple(row.values()))
+                for row in rows
+            )
         return {
-            "lr_action": table.lr_action,
-            "lr_goto": table.lr_goto,
-            "sr_conflicts": table.sr_conflicts,
-            "rr_conflicts": table.rr_conflicts,
-            "default_reductions": table.default_reductions,
-            "start": table.grammar.start,
-            "terminals": sorted(table.grammar.terminals),
-            "precedence": table.grammar.precedence,
-            "productions": [
-                (p.name, p.prod, p.prec) for p in table.grammar.productions
-            ],
+            "version": self.VERSION,
+            "grammar_hash": grammar_hash,
+            "symbols": tuple(symbols),
+            "lr_action": encode(table.lr_action),
+            "lr_goto": encode(table.lr_goto),
+            "default_reductions": tuple(table.default_reductions),
+            "sr_conflicts": tuple(table.sr_conflicts),
+            "rr_conflicts": tuple(table.rr_conflicts),
         }
 
-    def data_is_valid(self, g, data):
-        if g.start != data["start"]:
-            return False
-        if sorted(g.terminals) != data["terminals"]:
+    def data_is_valid(self, g, data, grammar_hash):
+        if not isinstance(data, dict):
             return False
-        if sorted(g.precedence) != sorted(data["precedence"]):
+        if data.get("version") != self.VERSION:
             return False
-        for key, (assoc, level) in iteritems(g.precedence):
-            if data["precedence"][key] != [assoc, level]:
-                return False
-        if len(g.productions) != len(data["productions"]):
+        if data.get("grammar_hash") != grammar_hash:
             return False
-        for p, (name, prod, (assoc, level)) in zip(g.productions, data["productions"]):
-            if p.name != name:
-                return False
-            if p.prod != prod:
-                return False
-            if p.prec != (assoc, level):
-                return False
-        return True
-
-    def build(self):
+        symbols = data["symbols"]
+        return (
+            set(symbols) ==
+            set(g.terminals) | set(g.nonterminals) | set(["$end"])
+        )
+
+    def build_grammar(self):
+        """
+        Returns the :class:`~rply.grammar.Grammar` of the productions defined
+        so far, without constructing its parse tables.
+        """
         g = Grammar(self.tokens)
 
         for level, (assoc, terms) in enumerate(self.precedence, 1):
@@ -154,6 +162,16 @@ class ParserGenerator(object):
             g.add_production(prod_name, syms, func, precedence)
 
         g.set_start()
+        return g
+
+    def build(self, dense=False, codegen=False):
+        """
+        Returns a parser for the grammar, an :class:`~rply.parser.LRParser`
+        or, if `dense` is true, a :class:`~rply.parser.DenseLRParser`. If
+        `codegen` is true, a :class:`~rply.codegen.DirectLRParser` is
+        returned, which executes generated code instead of the tables.
+        """
+        g = self.build_grammar()
 
         for unused_term in g.unused_terminals():
             warnings.warn(
@@ -168,30 +186,33 @@ class ParserGenerator(object):
                 stacklevel=2
             )
 
-        g.build_lritems()
-        g.compute_first()
-        g.compute_follow()
-
         table = None
         if self.cache_id is not None:
+            grammar_hash = self.compute_grammar_hash(g)
             cache_dir = AppDirs("rply").user_cache_dir
             cache_file = os.path.join(
                 cache_dir,
-                "%s-%s-%s.json" % (
-                    self.cache_id, self.VERSION, self.compute_grammar_hash(g)
-                )
+                "%s-%s-%s.lrtab" % (self.cache_id, self.VERSION, grammar_hash)
             )
 
             if os.path.exists(cache_file):
-                with open(cache_file) as f:
-                    data = json.load(f)
-                if self.data_is_valid(g, data):
+                with open(cache_file, "rb") as f:
+                    try:
+                        data = marshal.load(f)
+                    except (ValueError, EOFError, TypeError):
+                        data = None
+                if self.data_is_valid(g, data, grammar_hash):
                     table = LRTable.from_cache(g, data)
         if table is None:
+            # The LR items and first/follow sets are only needed to
+            # construct the tables.
+            g.build_lritems()
+            g.compute_first()
+            g.compute_follow()
             table = LRTable.from_grammar(g)
 
             if self.cache_id is not None:
-                self._write_cache(cache_dir, cache_file, table)
+                self._write_cache(cache_dir, cache_file, table, grammar_hash)
 
         if table.sr_conflicts:
             warnings.warn(
@@ -211,9 +232,13 @@ class ParserGenerator(object):
                 ParserGeneratorWarning,
                 stacklevel=2,
             )
+        if codegen:
+            return DirectLRParser(table, self.error_handler)
+        if dense:
+            return DenseLRParser(table, self.error_handler)
         return LRParser(table, self.error_handler)
 
-    def _write_cache(self, cache_dir, cache_file, table):
+    def _write_cache(self, cache_dir, cache_file, table, grammar_hash):
         if not os.path.exists(cache_dir):
             try:
                 os.makedirs(cache_dir, mode=0o0700)
@@ -222,43 +247,73 @@ class ParserGenerator(object):
                     return
                 raise
 
-        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False, mode="w") as f:
-            json.dump(self.serialize_table(table), f)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+            marshal.dump(self.serialize_table(table, grammar_hash), f)
         os.rename(f.name, cache_file)
 
 
 def digraph(X, R, FP):
+    """
+    Computes ``F(x) = FP(x) + F(y) for each y in R(x)`` for every ``x`` in
+    `X` with DeRemer and Pennello's algorithm, which gives all the members of
+    a strongly connected component of `R` the same list.
+    """
     N = dict.fromkeys(X, 0)
     stack = []
     F = {}
+    # The set of the members of each list in F, by id. The list is kept
+    # alongside, so that its id isn't reused while the set is.
+    members = {}
     for x in X:
         if N[x] == 0:
-            traverse(x, N, stack, F, X, R, FP)
+            traverse(x, N, stack, F, R, FP, members)
     return F
 
 
-def traverse(x, N, stack, F, X, R, FP):
+def traverse(x, N, stack, F, R, FP, members):
+    # Iterative, long chains of relations mustn't hit the recursion limit.
+    # Each frame is a node, its depth on the stack and its remaining relations.
     stack.append(x)
-    d = len(stack)
-    N[x] = d
+    N[x] = len(stack)
     F[x] = FP(x)
-
-    rel = R(x)
-    for y in rel:
-        if N[y] == 0:
-            traverse(y, N, stack, F, X, R, FP)
-        N[x] = min(N[x], N[y])
-        for a in F.get(y, []):
-            if a not in F[x]:
-                F[x].append(a)
-    if N[x] == d:
-        N[stack[-1]] = LARGE_VALUE
-        F[stack[-1]] = F[x]
-        element = stack.pop()
-        while element != x:
-            N[stack[-1]] = LARGE_VALUE
-            F[stack[-1]] = F[x]
-            element = stack.pop()
+    frames = [(x, len(stack), iter(R(x)))]
+    while frames:
+        x, d, rel = frames[-1]
+        for y in rel:
+            if N[y] == 0:
+                stack.append(y)
+                N[y] = len(stack)
+                F[y] = FP(y)
+                frames.append((y, len(stack), iter(R(y))))
+                break
+            _union(x, y, N, F, members)
+        else:
+            frames.pop()
+            if N[x] == d:
+                while True:
+                    element = stack.pop()
+                    N[element] = LARGE_VALUE
+                    F[element] = F[x]
+                    if element == x:
+                        break
+            if frames:
+                _union(frames[-1][0], x, N, F, members)
+
+
+def _union(x, y, N, F, members):
+    N[x] = min(N[x], N[y])
+    values = F[x]
+    entry = members.get(id(values))
+    if entry is None:
+        entry = members[id(values)] = values, set(values)
+    seen = entry[1]
+    new = F.get(y, [])
+    if seen.issuperset(new):
+        return
+    for a in new:
+        if a not in seen:
+            seen.add(a)
+            values.append(a)
 
 
 class LRTable(object):
@@ -273,31 +328,29 @@ class LRTable(object):
 
     @classmethod
     def from_cache(cls, grammar, data):
+        symbols = data["symbols"]
         lr_action = [
-            dict([(str(k), v) for k, v in iteritems(action)])
-            for action in data["lr_action"]
+            dict(zip([symbols[k] for k in keys], values))
+            for keys, values in data["lr_action"]
         ]
         lr_goto = [
-            dict([(str(k), v) for k, v in iteritems(goto)])
-            for goto in data["lr_goto"]
+            dict(zip([symbols[k] for k in keys], values))
+            for keys, values in data["lr_goto"]
         ]
         return LRTable(
             grammar,
             lr_action,
             lr_goto,
-            data["default_reductions"],
-            data["sr_conflicts"],
-            data["rr_conflicts"]
+            list(data["default_reductions"]),
+            [tuple(c) for c in data["sr_conflicts"]],
+            [tuple(c) for c in data["rr_conflicts"]]
         )
 
     @classmethod
     def from_grammar(cls, grammar):
-        cidhash = IdentityDict()
-        goto_cache = {}
-        add_count = Counter()
-        C = cls.lr0_items(grammar, add_count, cidhash, goto_cache)
+        C, goto = cls.lr0_items(grammar)
 
-        cls.add_lalr_lookaheads(grammar, C, add_count, cidhash, goto_cache)
+        cls.add_lalr_lookaheads(grammar, C, goto)
 
         lr_action = [None] * len(C)
         lr_goto = [None] * len(C)
@@ -352,8 +405,7 @@ class LRTable(object):
                     i = p.lr_index
                     a = p.prod[i + 1]
                     if a in grammar.terminals:
-                        g = cls.lr0_goto(I, a, add_count, goto_cache)
-                        j = cidhash.get(g, -1)
+                        j = goto[st].get(a, -1)
                         if j >= 0:
                             if a in st_action:
                                 r = st_action[a]
@@ -383,8 +435,7 @@ class LRTable(object):
                     if s in grammar.nonterminals:
                         nkeys.add(s)
             for n in nkeys:
-                g = cls.lr0_goto(I, n, add_count, goto_cache)
-                j = cidhash.get(g, -1)
+                j = goto[st].get(n, -1)
                 if j >= 0:
                     st_goto[n] = j
 
@@ -399,10 +450,16 @@ class LRTable(object):
         return LRTable(grammar, lr_action, lr_goto, default_reductions, sr_conflicts, rr_conflicts)
 
     @classmethod
-    def lr0_items(cls, grammar, add_count, cidhash, goto_cache):
-        C = [cls.lr0_closure([grammar.productions[0].lr_next], add_count)]
-        for i, I in enumerate(C):
-            cidhash[I] = i
+    def lr0_items(cls, grammar):
+        """
+        Returns the LR(0) states, as lists of items, and the transitions of
+        each state, a dict mapping a symbol to the number of the next state.
+        States are looked up by their kernel, the set of items they start
+        with.
+        """
+        C = [cls.lr0_closure([grammar.productions[0].lr_next])]
+        goto = []
+        states = {}
 
         i = 0
         while i < len(C):
@@ -410,64 +467,44 @@ class LRTable(object):
             i += 1
 
             asyms = set()
+            kernels = {}
             for ii in I:
                 asyms.update(ii.unique_syms)
+                n = ii.lr_next
+                if n is not None:
+                    kernels.setdefault(n.lr_before, []).append(n)
+            transitions = {}
             for x in asyms:
-                g = cls.lr0_goto(I, x, add_count, goto_cache)
-                if not g:
+                kernel = kernels.get(x)
+                if kernel is None:
                     continue
-                if g in cidhash:
-                    continue
-                cidhash[g] = len(C)
-                C.append(g)
-        return C
+                key = frozenset(kernel)
+                j = states.get(key)
+                if j is None:
+                    j = states[key] = len(C)
+                    C.append(cls.lr0_closure(kernel))
+                transitions[x] = j
+            goto.append(transitions)
+        return C, goto
 
     @classmethod
-    def lr0_closure(cls, I, add_count):
-        add_count.incr()
-
+    def lr0_closure(cls, I):
         J = I[:]
-        added = True
-        while added:
-            added = False
-            for j in J:
-                for x in j.lr_after:
-                    if x.lr0_added == add_count.value:
-                        continue
+        added = set()
+        # The loop also visits the items appended to J.
+        for j in J:
+            for x in j.lr_after:
+                if x not in added:
+                    added.add(x)
                     J.append(x.lr_next)
-                    x.lr0_added = add_count.value
-                    added = True
         return J
 
     @classmethod
-    def lr0_goto(cls, I, x, add_count, goto_cache):
-        s = goto_cache.setdefault(x, IdentityDict())
-
-        gs = []
-        for p in I:
-            n = p.lr_next
-            if n and n.lr_before == x:
-                s1 = s.get(n)
-                if not s1:
-                    s1 = {}
-                    s[n] = s1
-                gs.append(n)
-                s = s1
-        g = s.get("$end")
-        if not g:
-            if gs:
-                g = cls.lr0_closure(gs, add_count)
-                s["$end"] = g
-            else:
-                s["$end"] = gs
-        return g
-
-    @classmethod
-    def add_lalr_lookaheads(cls, grammar, C, add_count, cidhash, goto_cache):
+    def add_lalr_lookaheads(cls, grammar, C, goto):
         nullable = cls.compute_nullable_nonterminals(grammar)
         trans = cls.find_nonterminal_transitions(grammar, C)
-        readsets = cls.compute_read_sets(grammar, C, trans, nullable, add_count, cidhash, goto_cache)
-        lookd, included = cls.compute_lookback_includes(grammar, C, trans, nullable, add_count, cidhash, goto_cache)
+        readsets = cls.compute_read_sets(grammar, C, goto, trans, nullable)
+        lookd, included = cls.compute_lookback_includes(grammar, C, goto, trans, nullable)
         followsets = cls.compute_follow_sets(trans, readsets, included)
         cls.add_lookaheads(lookd, followsets)
 
@@ -493,20 +530,22 @@ class LRTable(object):
     @classmethod
     def find_nonterminal_transitions(cls, grammar, C):
         trans = []
+        seen = set()
         for idx, state in enumerate(C):
             for p in state:
                 if p.lr_index < p.getlength() - 1:
                     t = (idx, p.prod[p.lr_index + 1])
-                    if t[1] in grammar.nonterminals and t not in trans:
+                    if t[1] in grammar.nonterminals and t not in seen:
+                        seen.add(t)
                         trans.append(t)
         return trans
 
     @classmethod
-    def compute_read_sets(cls, grammar, C, ntrans, nullable, add_count, cidhash, goto_cache):
+    def compute_read_sets(cls, grammar, C, goto, ntrans, nullable):
         return digraph(
             ntrans,
-            R=lambda x: cls.reads_relation(C, x, nullable, add_count, cidhash, goto_cache),
-            FP=lambda x: cls.dr_relation(grammar, C, x, nullable, add_count, goto_cache)
+            R=lambda x: cls.reads_relation(C, goto, x, nullable),
+            FP=lambda x: cls.dr_relation(grammar, C, goto, x, nullable)
         )
 
     @classmethod
@@ -518,28 +557,29 @@ class LRTable(object):
         )
 
     @classmethod
-    def dr_relation(cls, grammar, C, trans, nullable, add_count, goto_cache):
+    def dr_relation(cls, grammar, C, goto, trans, nullable):
         state, N = trans
         terms = []
+        seen = set()
 
-        g = cls.lr0_goto(C[state], N, add_count, goto_cache)
+        g = C[goto[state][N]]
         for p in g:
             if p.lr_index < p.getlength() - 1:
                 a = p.prod[p.lr_index + 1]
-                if a in grammar.terminals and a not in terms:
+                if a in grammar.terminals and a not in seen:
+                    seen.add(a)
                     terms.append(a)
         if state == 0 and N == grammar.productions[0].prod[0]:
             terms.append("$end")
         return terms
 
     @classmethod
-    def reads_relation(cls, C, trans, empty, add_count, cidhash, goto_cache):
+    def reads_relation(cls, C, goto, trans, empty):
         rel = []
         state, N = trans
 
-        g = cls.lr0_goto(C[state], N, add_count, goto_cache)
-        j = cidhash.get(g, -1)
-        for p in g:
+        j = goto[state][N]
+        for p in C[j]:
             if p.lr_index < p.getlength() - 1:
                 a = p.prod[p.lr_index + 1]
                 if a in empty:
@@ -547,28 +587,41 @@ class LRTable(object):
         return rel
 
     @classmethod
-    def compute_lookback_includes(cls, grammar, C, trans, nullable, add_count, cidhash, goto_cache):
+    def compute_lookback_includes(cls, grammar, C, goto, trans, nullable):
         lookdict = {}
         includedict = {}
 
         dtrans = dict.fromkeys(trans, 1)
+        # The items of each state by the name of their production, in order,
+        # and the completed ones, which are the only ones to look back to.
+        by_name = {}
+        completed_by_name = {}
+
+        def named_items(state, name):
+            items = by_name.get(state)
+            if items is None:
+                items = by_name[state] = {}
+                completed = completed_by_name[state] = {}
+                for p in C[state]:
+                    items.setdefault(p.name, []).append(p)
+                    if p.lr_index == p.getlength() - 1:
+                        completed.setdefault(p.name, []).append(p)
+            return items.get(name, [])
 
         for state, N in trans:
             lookb = []
             includes = []
-            for p in C[state]:
-                if p.name != N:
-                    continue
-
+            for p in named_items(state, N):
+                length = p.getlength()
                 lr_index = p.lr_index
                 j = state
-                while lr_index < p.getlength() - 1:
+                while lr_index < length - 1:
                     lr_index += 1
                     t = p.prod[lr_index]
 
                     if (j, t) in dtrans:
                         li = lr_index + 1
-                        while li < p.getlength():
+                        while li < length:
                             if p.prod[li] in grammar.terminals:
                                 break
                             if p.prod[li] not in nullable:
@@ -577,20 +630,11 @@ class LRTable(object):
                         else:
                             includes.append((j, t))
 
-                    g = cls.lr0_goto(C[j], t, add_count, goto_cache)
-                    j = cidhash.get(g, -1)
-
-                for r in C[j]:
-                    if r.name != p.name:
-                        continue
-                    if r.getlength() != p.getlength():
-                        continue
-                    i = 0
-                    while i < r.lr_index:
-                        if r.prod[i] != p.prod[i + 1]:
-                            break
-                        i += 1
-                    else:
+                    j = goto[j].get(t, -1)
+
+                named_items(j, p.name)
+                for r in completed_by_name[j].get(p.name, []):
+                    if r.getlength() == length and r.prod[:-1] == p.prod[1:]:
                         lookb.append((j, r))
 
             for i in includes:
@@ -600,10 +644,18 @@ class LRTable(object):
 
     @classmethod
     def add_lookaheads(cls, lookbacks, followset):
+        # The set of the lookaheads of each (state, item), mirroring its list.
+        seen = {}
         for trans, lb in iteritems(lookbacks):
+            f = followset.get(trans, [])
             for state, p in lb:
-                f = followset.get(trans, [])
                 laheads = p.lookaheads.setdefault(state, [])
+                members = seen.get((state, p))
+                if members is None:
+                    members = seen[state, p] = set(laheads)
+                if members.issuperset(f):
+                    continue
                 for a in f:
-                    if a not in laheads:
+                    if a not in members:
+                        members.add(a)
                         laheads.append(a)
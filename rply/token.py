@@ -1,3 +1,7 @@
+import re
+from bisect import bisect_right
+
+
 class BaseBox(object):
     """
     A base class for polymorphic boxes that wrap parser results. Simply use
@@ -51,6 +55,25 @@ class Token(BaseBox):
         return self.value
 
 
+class LazyToken(Token):
+    """
+    A :class:`Token` which refers to its span of a bytes-like source, e.g. a
+    :class:`mmap.mmap`, and only decodes its value when it's accessed.
+    """
+    def __init__(self, name, source, start, end, source_pos=None,
+                 encoding="utf-8"):
+        self.name = name
+        self.source = source
+        self.start = start
+        self.end = end
+        self.source_pos = source_pos
+        self.encoding = encoding
+
+    @property
+    def value(self):
+        return bytes(self.source[self.start:self.end]).decode(self.encoding)
+
+
 class SourcePosition(object):
     """
     Represents the position of a character in some source string.
@@ -71,3 +94,84 @@ class SourcePosition(object):
         return "SourcePosition(idx={0}, lineno={1}, colno={2})".format(
             self.idx, self.lineno, self.colno
         )
+
+
+class LazySourcePosition(SourcePosition):
+    """
+    A :class:`SourcePosition` whose line and column numbers are only looked
+    up in a :class:`LineIndex` when they are accessed.
+    """
+    def __init__(self, idx, lines):
+        self.idx = idx
+        self.lines = lines
+
+    @property
+    def lineno(self):
+        return self.lines.lineno(self.idx)
+
+    @property
+    def colno(self):
+        return self.lines.colno(self.idx)
+
+
+NEWLINE = re.compile("\n")
+BYTES_NEWLINE = re.compile(b"\n")
+
+
+class LineIndex(object):
+    """
+    Maps indices in a source string to line and column numbers, using the
+    offsets at which lines start. These are computed in a single pass, the
+    first time a position is looked up.
+
+    In a bytes-like source the indices are byte offsets, but columns still
+    count characters, by decoding the line up to the index with `encoding`.
+    """
+    def __init__(self, s, encoding="utf-8"):
+        self.s = s
+        self.encoding = encoding
+        self.starts = None
+
+    def _compute_starts(self):
+        newline = NEWLINE if isinstance(self.s, str) else BYTES_NEWLINE
+        starts = [0]
+        starts.extend(m.end() for m in newline.finditer(self.s))
+        self.starts = starts
+
+    def get_starts(self):
+        """
+        Returns the list of indices at which lines start.
+        """
+        if self.starts is None:
+            self._compute_starts()
+        return self.starts
+
+    def lineno(self, idx):
+        """
+        Returns the number of the line in which the character at `idx`
+        occurs.
+        """
+        return bisect_right(self.get_starts(), idx)
+
+    def colno(self, idx):
+        """
+        Returns the number of the column in which the character at `idx`
+        occurs.
+        """
+        return self.column(idx, self.lineno(idx))
+
+    def column(self, idx, lineno):
+        """
+        Returns the number of the column in which the character at `idx`
+        occurs, given the number of its line `lineno`.
+        """
+        start = self.get_starts()[lineno - 1]
+        if isinstance(self.s, str):
+            return idx - start + 1
+        return len(bytes(self.s[start:idx]).decode(self.encoding, "replace")) + 1
+
+    def line_start(self, lineno):
+        """
+        Returns the index at which the line numbered `lineno` starts.
+        """
+        return self.get_starts()[lineno - 1]
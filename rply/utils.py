@@ -8,29 +8,24 @@ else:
 
 class IdentityDict(MutableMapping):
     def __init__(self):
+        # The key is kept alongside its value, so that its id isn't reused
+        # while it's in the dict.
         self._contents = {}
-        self._keepalive = []
 
     def __getitem__(self, key):
         return self._contents[id(key)][1]
 
     def __setitem__(self, key, value):
-        idx = len(self._keepalive)
-        self._keepalive.append(key)
-        self._contents[id(key)] = key, value, idx
+        self._contents[id(key)] = key, value
 
     def __delitem__(self, key):
         del self._contents[id(key)]
-        for idx, obj in enumerate(self._keepalive):
-            if obj is key:
-                del self._keepalive[idx]
-                break
 
     def __len__(self):
         return len(self._contents)
 
     def __iter__(self):
-        for key, _, _ in itervalues(self._contents):
+        for key, _ in itervalues(self._contents):
             yield key
 
 